@@ -1,9 +1,15 @@
 # abbreviations.py
 # This file defines "abbreviations" and tells Python how to interpret them
 
+from bisect import bisect_left
 from collections.abc import Iterable
 from dataclasses import dataclass
+import hashlib
+from heapq import heappop, heappush
+import json
+from pathlib import Path
 import re
+from typing import Any
 
 
 ###############################
@@ -17,10 +23,11 @@ import re
 # or more lowercase letters in the string. The remaining letters must always
 # appear in the same order as in the original string. An empty string is not a
 # valid abbreviation. The optional inclusion of arbitrarily chosen lowercase
-# letters means that I cannot write a function to *generate* abbreviations,
-# but that's okay. The code doesn't need to produce abbreviations, it just
-# needs to be able to unambiguously interpret the ones I invent so that the
-# recipes file can be a little less verbose.
+# letters means that there is no one "correct" abbreviation for a string, but
+# that's okay. The code mostly needs to be able to unambiguously interpret the
+# ones I invent so that the recipes file can be a little less verbose. When it
+# does have to produce abbreviations, it picks the shortest unique ones (see
+# AbbreviationIndex.shortest_abbreviation below).
 
 @dataclass(init=False, frozen=True, slots=True)
 class Abbreviation:
@@ -43,22 +50,322 @@ class Abbreviation:
         return re.match(self.regex, long_string) is not None
 
 
+####################################
+# AbbreviationIndex Implementation #
+####################################
+
+# Abbreviation.abbreviates() boils down to two independent conditions:
+#   1. The capitals (A-Z) of the abbreviation are exactly the capitals of the
+#      long string, in the same order, since "[^A-Z]*" can never skip one
+#   2. Each run of other letters in the abbreviation is a subsequence of the
+#      corresponding run of non-capitals between capitals in the long string
+# So we bucket the long strings by their capital "skeleton" with a dict, and
+# then we check condition 2 with a precomputed subsequence automaton for each
+# string in the bucket. A lookup costs O(len(abbreviation)) per candidate in
+# the bucket, with no regex matching and no scan over the whole collection.
+
+def _is_capital(char: str) -> bool:
+    return "A" <= char <= "Z"
+
+
+def capital_skeleton(string: str) -> str:
+    return "".join(char for char in string if _is_capital(char))
+
+
+class _SubsequenceAutomaton:
+
+    def __init__(self, long_string: str) -> None:
+        n = len(long_string)
+        self.long_string = long_string
+
+        # next_capital[i] is the index of the first capital at or after i
+        # next_other[i][char] is the first index of char at or after i, but
+        # only if no capital sits in between (the regex can't skip capitals)
+        self.next_capital: list[int] = [n] * (n + 1)
+        self.next_other: list[dict[str, int]] = [{} for _ in range(n + 1)]
+
+        for i in range(n - 1, -1, -1):
+            char = long_string[i]
+            if _is_capital(char):
+                self.next_capital[i] = i
+            else:
+                self.next_capital[i] = self.next_capital[i + 1]
+                self.next_other[i] = dict(self.next_other[i + 1])
+                self.next_other[i][char] = i
+
+    # The state after reading one more letter, or -1 if that letter can't
+    # match, with the same earliest-match rule that accepts() uses
+    def step(self, state: int, char: str) -> int:
+        n = len(self.long_string)
+        if _is_capital(char):
+            j = self.next_capital[state]
+            if j == n or self.long_string[j] != char:
+                return -1
+        else:
+            j = self.next_other[state].get(char, n)
+            if j == n:
+                return -1
+        return j + 1
+
+    # Greedily taking the earliest match for every letter is always optimal
+    def accepts(self, abbrev_str: str) -> bool:
+        n = len(self.long_string)
+        state = 0
+
+        for char in abbrev_str:
+            if "A" <= char <= "Z":  # Inlined _is_capital(), this loop is hot
+                j = self.next_capital[state]
+                if j == n or self.long_string[j] != char:
+                    return False
+            else:
+                j = self.next_other[state].get(char, n)
+                if j == n:
+                    return False
+            state = j + 1
+
+        # Any capitals left over in the long string would be unmatched
+        return self.next_capital[state] == n
+
+
+# Shared by the searches for every string in one skeleton bucket. Strings of
+# a bucket are numbered, and sets of them are bitmasks. For each run of
+# letters between capitals, a graph of the letters an abbreviation keeps in
+# that run has nodes for the set of strings whose run still contains those
+# letters in order, along with each such string's automaton state. Nodes
+# with the same states are the same node, since everything after them in
+# the run plays out the same. Which strings accept an abbreviation is then
+# just the AND of its runs' sets, so a search never steps any other string's
+# automaton itself. A step out of a node costs O(strings in it), but only
+# the first time any search in the bucket takes it.
+class _BucketRunGraph:
+
+    def __init__(self, automatons: list[_SubsequenceAutomaton]) -> None:
+        self.automatons = automatons
+        self.all_strings = (1 << len(automatons)) - 1
+        self.bits: dict[str, int] = {
+            a.long_string: 1 << m for m, a in enumerate(automatons)
+        }
+
+        # Nodes are numbered, and these hold each node's (string number,
+        # automaton state) pairs, the bitmask of those strings, and the steps
+        # out of it taken so far
+        self.node_ids: dict[tuple[int, tuple[tuple[int, int], ...]], int] = {}
+        self.states: list[tuple[tuple[int, int], ...]] = []
+        self.masks: list[int] = []
+        self.children: list[dict[str, int]] = []
+        self.roots: dict[int, int] = {}
+
+    def _node(self, run: int, states: tuple[tuple[int, int], ...]) -> int:
+        node = self.node_ids.get((run, states))
+        if node is None:
+            node = len(self.states)
+            self.node_ids[(run, states)] = node
+            self.states.append(states)
+            mask = 0
+            for m, _ in states:
+                mask |= 1 << m
+            self.masks.append(mask)
+            self.children.append({})
+        return node
+
+    # Every string of the bucket, just past the capital that starts the run
+    def root(self, run: int) -> int:
+        if run not in self.roots:
+            states: list[tuple[int, int]] = []
+            for m, automaton in enumerate(self.automatons):
+                state = 0
+                for _ in range(run):
+                    state = automaton.next_capital[state] + 1
+                states.append((m, state))
+            self.roots[run] = self._node(run, tuple(states))
+        return self.roots[run]
+
+    def step(self, run: int, node: int, char: str) -> int:
+        child = self.children[node].get(char)
+        if child is None:
+            states = tuple(
+                (m, state) for m, state in (
+                    (m, self.automatons[m].step(s, char))
+                    for m, s in self.states[node]
+                )
+                if state >= 0
+            )
+            child = self._node(run, states)
+            self.children[node][char] = child
+        return child
+
+
+# Position in a string, node of the run graph for the letters kept since the
+# last capital before it, set of strings that still accept what's kept, and
+# whether anything at all has been kept yet
+_SearchState = tuple[int, int, int, bool]
+
+
+class AbbreviationIndex:
+
+    def __init__(self, string_collection: Iterable[str]) -> None:
+        self.skeleton_table: dict[str, list[_SubsequenceAutomaton]] = {}
+        for long_string in set(string_collection):
+            skeleton = capital_skeleton(long_string)
+            if skeleton not in self.skeleton_table:
+                self.skeleton_table[skeleton] = []
+            self.skeleton_table[skeleton].append(
+                _SubsequenceAutomaton(long_string)
+            )
+
+        # Built on demand by shortest_abbreviation(), one per skeleton
+        self._run_graphs: dict[str, _BucketRunGraph] = {}
+
+    def matches(self, abbrev: Abbreviation) -> set[str]:
+        candidates = self.skeleton_table.get(capital_skeleton(abbrev.string))
+        if candidates is None:
+            return set()
+        return set(
+            automaton.long_string for automaton in candidates
+            if automaton.accepts(abbrev.string)
+        )
+
+    # Group the abbreviations by skeleton first, so each bucket of the index
+    # gets visited once no matter how many abbreviations land in it
+    def match_all(
+        self,
+        abbrevs: Iterable[Abbreviation]
+    ) -> dict[str, set[str]]:
+        by_skeleton: dict[str, list[Abbreviation]] = {}
+        for abbrev in abbrevs:
+            skeleton = capital_skeleton(abbrev.string)
+            if skeleton not in by_skeleton:
+                by_skeleton[skeleton] = []
+            by_skeleton[skeleton].append(abbrev)
+
+        all_matches: dict[str, set[str]] = {}
+        for skeleton, skeleton_abbrevs in by_skeleton.items():
+            candidates = self.skeleton_table.get(skeleton, [])
+            for abbrev in skeleton_abbrevs:
+                all_matches[abbrev.string] = set(
+                    automaton.long_string for automaton in candidates
+                    if automaton.accepts(abbrev.string)
+                )
+        return all_matches
+
+    def _bucket_run_graph(self, skeleton: str) -> _BucketRunGraph:
+        if skeleton not in self._run_graphs:
+            self._run_graphs[skeleton] = _BucketRunGraph(
+                self.skeleton_table.get(skeleton, [])
+            )
+        return self._run_graphs[skeleton]
+
+    # The shortest abbreviation that matches only this string: all of its
+    # capitals plus as few other letters as possible, with ties going to the
+    # letters furthest left. Only strings sharing its skeleton can conflict.
+    # Returns None when no abbreviation works, e.g. "Mk.1" versus "Mk.2".
+    # This is a cheapest-first search over states (position in the string,
+    # run graph node of the letters kept in its run, set of strings that
+    # still accept what's kept), where keeping a letter costs 1 and going on
+    # to the next capital is free, and it stops once no other string is left.
+    # From each state, only the first of each letter before the next capital
+    # is worth keeping, since a later copy leads to the same node with fewer
+    # options left. The number of states is at most the string's length
+    # times the nodes of its runs, times the distinct sets of strings, which
+    # in practice shrink to nothing within a few kept letters. Each state
+    # costs a bitmask AND and a heap push per letter kept from it, and the
+    # other strings of the bucket only ever get looked at through the shared
+    # run graph (see _BucketRunGraph above), never one by one per search.
+    def shortest_abbreviation(self, long_string: str) -> str | None:
+        graph = self._bucket_run_graph(capital_skeleton(long_string))
+        n = len(long_string)
+        capitals = [
+            i for i, char in enumerate(long_string) if _is_capital(char)
+        ]
+        next_capital = capitals + [n]
+
+        # The string itself, when it's in the bucket, always stays in
+        own_bit = graph.bits.get(long_string, 0)
+
+        # Heap entries sort by cost, then by the kept letters' positions, so
+        # the first state reached is reached the cheapest, leftmost way
+        start: _SearchState = (0, graph.root(0), graph.all_strings, False)
+        heap: list[tuple[int, tuple[int, ...], _SearchState]] = [
+            (0, (), start)
+        ]
+        seen: set[_SearchState] = set()
+
+        while len(heap) > 0:
+            cost, kept, state = heappop(heap)
+            if state in seen:
+                continue
+            seen.add(state)
+
+            i, node, alive, nonempty = state
+            if alive == own_bit and (nonempty or len(capitals) > 0):
+                kept_indices = sorted(capitals + list(kept))
+                return "".join(long_string[j] for j in kept_indices)
+
+            # Keep one of the letters up to the next capital, or pass it
+            run = bisect_left(next_capital, i)
+            k = next_capital[run]
+            firsts: set[str] = set()
+            for j in range(i, k):
+                char = long_string[j]
+                if char.isalpha() and char not in firsts:
+                    firsts.add(char)
+                    child = graph.step(run, node, char)
+                    heappush(heap, (cost + 1, kept + (j,), (
+                        j + 1, child, alive & graph.masks[child], True
+                    )))
+            if k < n:
+                heappush(heap, (
+                    cost, kept, (k + 1, graph.root(run + 1), alive, True)
+                ))
+
+        return None
+
+    # Each bucket's run graph is dropped once all of its strings are done
+    def generate_abbreviations(self) -> dict[str, str]:
+        abbreviations: dict[str, str] = {}
+        for skeleton, automatons in self.skeleton_table.items():
+            for automaton in automatons:
+                long_string = automaton.long_string
+                abbrev_str = self.shortest_abbreviation(long_string)
+                if abbrev_str is not None:
+                    abbreviations[long_string] = abbrev_str
+            self._run_graphs.pop(skeleton, None)
+        return abbreviations
+
+
 #######################################
 # AbbreviationResolver Implementation #
 #######################################
 
+# Both successful and failed resolutions are memoized, so every abbreviation
+# in the recipe file is only resolved once no matter how often it's repeated
+# The index is only built on the first cache miss, so a resolver warmed up from
+# a saved lookup table never has to build it at all
 class AbbreviationResolver:
 
     def __init__(self, string_collection: Iterable[str]) -> None:
         self.string_collection: set[str] = set(string_collection)
         self.lookup_table: dict[str, str] = dict()
+        self.failure_table: dict[str, str] = dict()
+        self._index: AbbreviationIndex | None = None
 
-    def _resolve_abbreviation(self, abbrev: Abbreviation) -> str:
-        possible_matches: set[str] = set()
-        for long_string in self.string_collection:
-            if abbrev.abbreviates(long_string):
-                possible_matches.add(long_string)
+    @property
+    def index(self) -> AbbreviationIndex:
+        if self._index is None:
+            self._index = AbbreviationIndex(self.string_collection)
+        return self._index
+
+    # Identifies the string collection, so saved tables go stale automatically
+    @property
+    def collection_hash(self) -> str:
+        joined = "\n".join(sorted(self.string_collection))
+        return hashlib.sha256(joined.encode("utf-8")).hexdigest()
 
+    def _check_matches(
+        self,
+        abbrev: Abbreviation,
+        possible_matches: set[str]
+    ) -> str:
         if len(possible_matches) > 1:
             raise ValueError(
                 "too many strings match abbreviation: "
@@ -71,8 +378,126 @@ class AbbreviationResolver:
 
         return possible_matches.pop()
 
+    def _resolve_abbreviation(self, abbrev: Abbreviation) -> str:
+        return self._check_matches(abbrev, self.index.matches(abbrev))
+
     def __call__(self, abbrev_str: str) -> str:
         try:
             return self.lookup_table[abbrev_str]
         except KeyError:
-            return self._resolve_abbreviation(Abbreviation(abbrev_str))
+            pass
+
+        if abbrev_str in self.failure_table:
+            raise ValueError(self.failure_table[abbrev_str])
+
+        try:
+            long_string = self._resolve_abbreviation(Abbreviation(abbrev_str))
+        except ValueError as e:
+            self.failure_table[abbrev_str] = str(e)
+            raise
+
+        self.lookup_table[abbrev_str] = long_string
+        return long_string
+
+    # Resolve a whole batch of distinct abbreviations in one sweep of the index
+    # Instead of stopping at the first bad one, collect all the error messages
+    def try_resolve_all(
+        self,
+        abbrev_strs: Iterable[str]
+    ) -> tuple[dict[str, str], list[str]]:
+        resolved: dict[str, str] = {}
+        errors: list[str] = []
+        pending: dict[str, Abbreviation] = {}
+
+        for abbrev_str in abbrev_strs:
+            if abbrev_str in resolved or abbrev_str in pending:
+                continue
+            if abbrev_str in self.lookup_table:
+                resolved[abbrev_str] = self.lookup_table[abbrev_str]
+            elif abbrev_str in self.failure_table:
+                errors.append(self.failure_table[abbrev_str])
+            else:
+                try:
+                    pending[abbrev_str] = Abbreviation(abbrev_str)
+                except ValueError as e:
+                    self.failure_table[abbrev_str] = str(e)
+                    errors.append(str(e))
+
+        if len(pending) == 0:
+            return resolved, errors
+
+        all_matches = self.index.match_all(pending.values())
+        for abbrev_str, abbrev in pending.items():
+            try:
+                long_string = self._check_matches(
+                    abbrev, all_matches[abbrev_str]
+                )
+            except ValueError as e:
+                self.failure_table[abbrev_str] = str(e)
+                errors.append(str(e))
+                continue
+            self.lookup_table[abbrev_str] = long_string
+            resolved[abbrev_str] = long_string
+
+        return resolved, errors
+
+    def resolve_all(self, abbrev_strs: Iterable[str]) -> dict[str, str]:
+        resolved, errors = self.try_resolve_all(abbrev_strs)
+        if len(errors) > 0:
+            raise resolution_error(errors)
+        return resolved
+
+
+def resolution_error(errors: list[str]) -> ValueError:
+    return ValueError(
+        f"unable to resolve {len(errors)} abbreviation(s):\n  "
+        + "\n  ".join(errors)
+    )
+
+
+###################################
+# Abbreviation Cache File Support #
+###################################
+
+# The cache file is a JSON object mapping collection hashes to lookup tables
+# Only tables for the resolvers passed in are kept when the file is rewritten,
+# so entries for outdated product or category names get dropped along the way
+
+def _read_abbreviation_cache(cache_file_name: Path) -> dict[str, Any]:
+    try:
+        with open(cache_file_name, "r", encoding="utf-8") as f:
+            cache_data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache_data if isinstance(cache_data, dict) else {}
+
+
+def load_abbreviation_cache(
+    cache_file_name: Path,
+    *resolvers: AbbreviationResolver
+) -> int:
+    cache_data = _read_abbreviation_cache(cache_file_name)
+
+    loaded = 0
+    for resolver in resolvers:
+        table = cache_data.get(resolver.collection_hash)
+        if not isinstance(table, dict):
+            continue
+        for abbrev_str, long_string in table.items():
+            if long_string in resolver.string_collection:
+                resolver.lookup_table[abbrev_str] = long_string
+                loaded += 1
+
+    return loaded
+
+
+def save_abbreviation_cache(
+    cache_file_name: Path,
+    *resolvers: AbbreviationResolver
+) -> None:
+    cache_data = {
+        resolver.collection_hash: resolver.lookup_table
+        for resolver in resolvers
+    }
+    with open(cache_file_name, "w", encoding="utf-8") as f:
+        json.dump(cache_data, f, indent=1, sort_keys=True)
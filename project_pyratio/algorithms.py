@@ -94,6 +94,8 @@ def make_goal_decision(db: DataBase) -> ProductQuantity[Rate] | None:
     return ProductQuantity(rate, item)
 
 
+# The gap suggested by the factory's gap order goes at the top of the menu,
+# where the cursor starts, and the rest follow in name order
 def make_production_decision(
     factory: Factory,
     db: DataBase
@@ -102,11 +104,14 @@ def make_production_decision(
 
     if len(possible_targets) == 0:
         return None
+    suggested = find_next_production_gap(factory, db)
     return get_user_choice(
         "Choose next production target to satisfy:",
         possible_targets,
         "<ignore all and finish>",
-        sort_by=lambda x: x.name
+        sort_by=lambda x: (
+            suggested is None or x.product != suggested.product, x.name
+        )
     )
 
 
@@ -114,10 +119,21 @@ def make_production_decision(
 # Algorithms for Factory Expansion #
 ####################################
 
+# Factories made with a DataBase track their gaps as they change, so there's
+# no need to go over every product (see GapTracker in factories.py)
 def find_production_gaps(
     factory: Factory,
     db: DataBase
 ) -> list[ProductQuantity[Rate]]:
+    tracker = factory.gap_tracker
+    if tracker is not None:
+        for product in list(tracker.uncraftable):
+            factory.set_ignored(product)
+        return [
+            ProductQuantity(-rate, product)
+            for product, rate in tracker.gaps.items()
+        ]
+
     possible_gaps = factory.negative_rates()
     verified_gaps: list[ProductQuantity[Rate]] = []
 
@@ -130,6 +146,22 @@ def find_production_gaps(
     return verified_gaps
 
 
+# The gap to work on first, by the gap order of the factory's tracker
+# Without a tracker, this just goes with the biggest gap
+def find_next_production_gap(
+    factory: Factory,
+    db: DataBase
+) -> ProductQuantity[Rate] | None:
+    tracker = factory.gap_tracker
+    if tracker is None:
+        gaps = find_production_gaps(factory, db)
+        return max(gaps, key=lambda gap: gap.quantity, default=None)
+
+    for product in list(tracker.uncraftable):
+        factory.set_ignored(product)
+    return tracker.next_gap()
+
+
 def expand_factory_once(
     factory: Factory,
     db: DataBase,
@@ -150,7 +182,9 @@ def expand_factory_once(
             factory.set_ignored(objective.product)
             return factory
 
-        new_crafter = RecipeCrafter.with_goal(recipe, facility, objective)
+        new_crafter = RecipeCrafter.with_goal(
+            recipe, facility, objective, db.unit_rates(recipe)
+        )
         factory.connect_crafter(new_crafter)
 
     else:  # Expand an existing crafter
@@ -165,7 +199,7 @@ def generate_factory(db: DataBase) -> Factory | None:
     goal = make_goal_decision(db)
     if goal is None:
         return None
-    factory = Factory(goal)
+    factory = Factory(goal, db)
 
     while True:
         target = make_production_decision(factory, db)
@@ -0,0 +1,144 @@
+# compiled_databases.py
+# Read-only integer ID view of DataBase contents for number crunching code
+
+from array import array
+from collections.abc import Iterable, Iterator
+from fractions import Fraction
+from math import lcm
+
+from facilities import Facility, FacilityCategory
+from products import Product, ProductQuantity
+from rates import RateScale
+from recipes import Recipe
+
+
+###############################################
+# CompiledDataBase Type and Inner Constructor #
+###############################################
+
+# Products, recipes, facilities, and facility categories all get dense IDs,
+# counting up from zero in name order, so the same data always compiles to the
+# same IDs. Recipe ingredients are stored in CSR form: the ingredients of the
+# recipe with ID r are at positions offsets[r] up to offsets[r + 1] of the
+# parallel product ID and quantity arrays. Every array is handed out as a
+# read-only memoryview, since this is only a snapshot of the DataBase.
+# Use DataBase.compile() to get one, it keeps this in sync with the DataBase.
+class CompiledDataBase:
+
+    def __init__(
+        self,
+        products: Iterable[Product],
+        recipes: Iterable[Recipe],
+        facilities: Iterable[Facility]
+    ) -> None:
+        recipe_list = sorted(recipes, key=lambda r: r.name)
+        facility_list = sorted(facilities, key=lambda f: f.name)
+
+        # Recipes could still use products that a data layer has removed
+        all_products = set(products)
+        all_categories: set[FacilityCategory] = set()
+        for recipe in recipe_list:
+            all_products.update(q.product for q in recipe.outputs)
+            all_products.update(q.product for q in recipe.inputs)
+            all_categories.add(recipe.category)
+        all_categories.update(f.category for f in facility_list)
+
+        self.products = tuple(sorted(all_products, key=lambda p: p.name))
+        self.recipes = tuple(recipe_list)
+        self.facilities = tuple(facility_list)
+        self.categories = tuple(sorted(all_categories, key=lambda c: c.name))
+
+        self.product_ids = {p: i for i, p in enumerate(self.products)}
+        self.recipe_ids = {r.name: i for i, r in enumerate(self.recipes)}
+        self.facility_ids = {f.name: i for i, f in enumerate(self.facilities)}
+        self.category_ids = {c: i for i, c in enumerate(self.categories)}
+
+        self.output_offsets, self.output_products, self.output_quantities = (
+            self._make_csr_table(r.outputs for r in self.recipes)
+        )
+        self.input_offsets, self.input_products, self.input_quantities = (
+            self._make_csr_table(r.inputs for r in self.recipes)
+        )
+
+        self.recipe_periods: tuple[Fraction, ...] = tuple(
+            r.period.seconds for r in self.recipes
+        )
+        self.recipe_categories = memoryview(array("q", (
+            self.category_ids[r.category] for r in self.recipes
+        ))).toreadonly()
+
+        self.facility_speeds: tuple[Fraction, ...] = tuple(
+            f.speed for f in self.facilities
+        )
+        self.facility_categories = memoryview(array("q", (
+            self.category_ids[f.category] for f in self.facilities
+        ))).toreadonly()
+
+        # Any quantity * speed / period is a whole number of these units
+        self.rate_scale = RateScale(
+            lcm(*(period.numerator for period in self.recipe_periods))
+            * lcm(*(speed.denominator for speed in self.facility_speeds))
+        )
+
+    def _make_csr_table(
+        self,
+        ingredient_lists: Iterable[tuple[ProductQuantity[int], ...]]
+    ) -> tuple[memoryview, memoryview, memoryview]:
+        offsets = array("q", [0])
+        product_ids = array("q")
+        quantities = array("q")
+
+        for ingredients in ingredient_lists:
+            for ingredient in ingredients:
+                product_ids.append(self.product_ids[ingredient.product])
+                quantities.append(ingredient.quantity)
+            offsets.append(len(product_ids))
+
+        return (
+            memoryview(offsets).toreadonly(),
+            memoryview(product_ids).toreadonly(),
+            memoryview(quantities).toreadonly(),
+        )
+
+    # memoryview objects can't be pickled, so pickle the source data instead
+    def __reduce__(self) -> tuple[type['CompiledDataBase'], tuple[
+        tuple[Product, ...], tuple[Recipe, ...], tuple[Facility, ...]
+    ]]:
+        return (
+            CompiledDataBase,
+            (self.products, self.recipes, self.facilities),
+        )
+
+    ####################################
+    # CompiledDataBase Query Functions #
+    ####################################
+
+    def product_id(self, product: Product | str) -> int:
+        if not isinstance(product, Product):
+            product = Product(product)
+        if product not in self.product_ids:
+            raise ValueError(f"unknown product name: {product.name!r}")
+        return self.product_ids[product]
+
+    def recipe_id(self, recipe: Recipe | str) -> int:
+        name = recipe.name if isinstance(recipe, Recipe) else recipe
+        if name not in self.recipe_ids:
+            raise ValueError(f"unknown recipe name: {name!r}")
+        return self.recipe_ids[name]
+
+    # Pairs of (product ID, quantity) for one recipe
+    def recipe_outputs(self, recipe_id: int) -> Iterator[tuple[int, int]]:
+        start = self.output_offsets[recipe_id]
+        stop = self.output_offsets[recipe_id + 1]
+        return zip(
+            self.output_products[start:stop],
+            self.output_quantities[start:stop],
+        )
+
+    def recipe_inputs(self, recipe_id: int) -> Iterator[tuple[int, int]]:
+        start = self.input_offsets[recipe_id]
+        stop = self.input_offsets[recipe_id + 1]
+        return zip(
+            self.input_products[start:stop],
+            self.input_quantities[start:stop],
+        )
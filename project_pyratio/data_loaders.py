@@ -1,15 +1,30 @@
 # data_loaders.py
 # Functions for loading DSP data types from (mainly TOML) files into Python
 
+from collections.abc import Callable
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+import hashlib
 from pathlib import Path
+import pickle
+import threading
+import time
 import tomllib
 from typing import Any
 
 from databases import DataBase
 from facilities import FacilityCategory, Facility
+from layered_databases import LayeredDataBase
 from products import Product
 from rates import Rate, Time
-from recipe_readers import read_recipe, read_recipe_file
+from recipe_readers import (
+    iter_hashed_recipe_file,
+    iter_recipe_blocks,
+    read_recipe,
+    recipe_block_hash,
+    resolve_recipe_blocks,
+)
+from recipes import Recipe
 
 
 ################################
@@ -23,6 +38,22 @@ PRODUCTS_FILE_NAME: Path = GAME_DATA_DIRECTORY / "products.toml"
 RECIPES_FILE_NAME: Path = GAME_DATA_DIRECTORY / "recipes.dat"
 RATES_FILE_NAME: Path = GAME_DATA_DIRECTORY / "rates.toml"
 
+GAME_DATA_FILE_NAMES: tuple[Path, ...] = (
+    FACILITIES_FILE_NAME,
+    PRODUCTS_FILE_NAME,
+    RECIPES_FILE_NAME,
+    RATES_FILE_NAME,
+)
+
+# Resolved recipe file abbreviations are cached here between runs
+ABBREVIATIONS_FILE_NAME: Path = GAME_DATA_DIRECTORY / "abbreviations.json"
+
+# Data layers (i.e. mods) list what they take away from lower layers in here
+REMOVALS_FILE_NAME: Path = GAME_DATA_DIRECTORY / "removals.toml"
+
+# A fully built DataBase (lookup tables and all) is cached here between runs
+SNAPSHOT_FILE_NAME: Path = GAME_DATA_DIRECTORY / "database.snapshot"
+
 
 #####################################
 # Facilities Data Loading Functions #
@@ -31,7 +62,7 @@ RATES_FILE_NAME: Path = GAME_DATA_DIRECTORY / "rates.toml"
 def _load_data_facility_category(db: DataBase, toml_data: str) -> DataBase:
     fc_name = toml_data
 
-    fc = FacilityCategory(fc_name)
+    fc = db.intern_category(fc_name)
 
     if fc in db.facility_categories:
         raise ValueError(f"duplicate facility category name: {fc.name!r}")
@@ -45,7 +76,7 @@ def _load_data_facility(db: DataBase, toml_data: dict[str, Any]) -> DataBase:
     f_adjective: str = toml_data["adjective"]
     f_speed: int | float = toml_data["speed"]
 
-    f = Facility(f_category_name, f_adjective, f_speed)
+    f = Facility(db.intern_category(f_category_name), f_adjective, f_speed)
 
     if f.name in db.facilities:
         raise ValueError(f"duplicate facility name: {f.name!r}")
@@ -57,13 +88,13 @@ def _load_data_facility(db: DataBase, toml_data: dict[str, Any]) -> DataBase:
 
 
 def _load_facilities_data(db: DataBase, toml_file_name: Path) -> DataBase:
-    with open(toml_file_name, "rb", encoding="utf-8") as f:
+    with open(toml_file_name, "rb") as f:
         toml_table = tomllib.load(f)
 
-    for category_data in toml_table["facility categories"]:
+    for category_data in toml_table.get("facility categories", []):
         _load_data_facility_category(db, category_data)
 
-    for facility_data in toml_table["facilities"]:
+    for facility_data in toml_table.get("facilities", []):
         _load_data_facility(db, facility_data)
 
     return db
@@ -76,7 +107,7 @@ def _load_facilities_data(db: DataBase, toml_file_name: Path) -> DataBase:
 def _load_data_product(db: DataBase, toml_data: str) -> DataBase:
     p_name = toml_data
 
-    p = Product(p_name)
+    p = db.intern_product(p_name)
 
     if p in db.products:
         raise ValueError(f"duplicate product name: {p.name!r}")
@@ -86,10 +117,10 @@ def _load_data_product(db: DataBase, toml_data: str) -> DataBase:
 
 
 def _load_products_data(db: DataBase, toml_file_name: Path) -> DataBase:
-    with open(toml_file_name, "rb", encoding="utf-8") as f:
+    with open(toml_file_name, "rb") as f:
         toml_table = tomllib.load(f)
 
-    for product_data in toml_table["products"]:
+    for product_data in toml_table.get("products", []):
         _load_data_product(db, product_data)
 
     return db
@@ -99,27 +130,90 @@ def _load_products_data(db: DataBase, toml_file_name: Path) -> DataBase:
 # Recipes Data Loading Functions #
 ##################################
 
-# Implementations of readrecipe() and readrecipefile() are in recipereaders.py
+# Implementations of read_recipe() and iter_hashed_recipe_file() are in
+# recipe_readers.py
+
+# The block hash is remembered so that reload_recipes() can detect edits
+def _add_recipe(
+    db: DataBase,
+    r: Recipe,
+    block_hash: str | None = None
+) -> DataBase:
+    if r.name in db.recipes:
+        raise ValueError(f"duplicate recipe name: {r.name!r}")
+
+    r = db.intern_recipe(r)
+    db.recipes[r.name] = r
+    if block_hash is not None:
+        db.recipe_block_hashes[block_hash] = r.name
+    return db
+
 
 def _load_data_recipe(db: DataBase, recipe_data: list[str]) -> DataBase:
     recipe_block = recipe_data
 
     r = read_recipe(recipe_block)
 
-    if r.name in db.recipes:
-        raise ValueError(f"duplicate recipe name: {r.name!r}")
+    return _add_recipe(db, r)
+
+
+# Each data directory gets its own cache, so layers don't evict each other
+def _abbreviations_file_name(data_file_name: Path) -> Path:
+    return data_file_name.parent / ABBREVIATIONS_FILE_NAME.name
+
+
+# Blocks are handed to worker processes in shards of this many at a time
+RECIPE_SHARD_SIZE: int = 2000
+
+
+# Runs in the worker processes, so it must stay a module-level function
+def _read_recipe_shard(recipe_blocks: list[list[str]]) -> list[Recipe]:
+    return [read_recipe(recipe_block) for recipe_block in recipe_blocks]
+
+
+def _load_recipes_data_parallel(
+    db: DataBase,
+    data_file_name: Path,
+    workers: int
+) -> DataBase:
+
+    # Abbreviations are all resolved up front, leaving independent blocks
+    raw_blocks = list(iter_recipe_blocks(data_file_name))
+    block_hashes = [recipe_block_hash(block) for block in raw_blocks]
+    recipe_table = resolve_recipe_blocks(
+        raw_blocks, db, _abbreviations_file_name(data_file_name)
+    )
+    shards = [
+        recipe_table[i:i + RECIPE_SHARD_SIZE]
+        for i in range(0, len(recipe_table), RECIPE_SHARD_SIZE)
+    ]
+
+    # Executor.map() yields in submission order, so recipes are added in file
+    # order and duplicate names are caught exactly like the serial loader
+    recipe_hashes = iter(block_hashes)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for recipes in executor.map(_read_recipe_shard, shards):
+            for r in recipes:
+                _add_recipe(db, r, next(recipe_hashes))
 
-    db.recipes[r.name] = r
     return db
 
 
-def _load_recipes_data(db: DataBase, data_file_name: Path) -> DataBase:
+# Parsing runs in a process pool when workers > 1, otherwise it's streamed
+def _load_recipes_data(
+    db: DataBase,
+    data_file_name: Path,
+    workers: int = 1
+) -> DataBase:
+    if workers > 1:
+        return _load_recipes_data_parallel(db, data_file_name, workers)
 
     # Pass in the database so it can be used to resolve abbreviations
-    recipe_table = read_recipe_file(data_file_name, db)
-
-    for recipe_data in recipe_table:
-        _load_data_recipe(db, recipe_data)
+    # Recipes are parsed one block at a time while the file is streamed
+    for block_hash, r in iter_hashed_recipe_file(
+        data_file_name, db, _abbreviations_file_name(data_file_name)
+    ):
+        _add_recipe(db, r, block_hash)
 
     return db
 
@@ -161,13 +255,13 @@ def _load_data_time(db: DataBase, toml_data: tuple[str, Any]) -> DataBase:
 
 
 def _load_rates_data(db: DataBase, toml_file_name: Path) -> DataBase:
-    with open(toml_file_name, "rb", encoding="utf-8") as f:
+    with open(toml_file_name, "rb") as f:
         toml_table = tomllib.load(f)
 
-    for rate_data in toml_table["rates"]:
+    for rate_data in toml_table.get("rates", []):
         _load_data_rate(db, rate_data)
 
-    for time_data in toml_table["times"]:
+    for time_data in toml_table.get("times", []):
         _load_data_time(db, time_data)
 
     return db
@@ -177,13 +271,376 @@ def _load_rates_data(db: DataBase, toml_file_name: Path) -> DataBase:
 # Top-Level DataBase Loading Function #
 #######################################
 
-def load_database(db: DataBase) -> DataBase:
-    print("Loading contents of DataBase from files...", end="", flush=True)
+# Each stage only touches its own part of the DataBase, so stages can run on
+# separate threads as long as the recipe stage waits for the facilities and
+# products stages (abbreviations are resolved against their names)
+
+DataLoader = Callable[[DataBase, Path], DataBase]
+
+
+def _run_loading_stage(
+    db: DataBase,
+    loader: DataLoader,
+    file_name: Path,
+    waits_for: list[Future[float]]
+) -> float:
+    for dependency in waits_for:
+        dependency.result()  # Raises again if the dependency stage failed
+
+    start = time.perf_counter()
+    loader(db, file_name)
+    return time.perf_counter() - start
+
+
+# Set recipe_workers above 1 to parse huge recipe files on several cores
+def load_database(
+    db: DataBase,
+    recipe_workers: int = 1,
+    directory: Path = GAME_DATA_DIRECTORY
+) -> DataBase:
+    print("Loading contents of DataBase from files...", flush=True)
+
+    def load_recipes(db: DataBase, file_name: Path) -> DataBase:
+        return _load_recipes_data(db, file_name, recipe_workers)
+
+    # Stage name => (loader function, data file, names of prerequisite stages)
+    # Stages must be listed after all of their prerequisites
+    stages: dict[str, tuple[DataLoader, Path, tuple[str, ...]]] = {
+        "facilities": (_load_facilities_data, FACILITIES_FILE_NAME, ()),
+        "products": (_load_products_data, PRODUCTS_FILE_NAME, ()),
+        "rates": (_load_rates_data, RATES_FILE_NAME, ()),
+        "recipes": (
+            load_recipes, RECIPES_FILE_NAME, ("facilities", "products")
+        ),
+    }
+
+    futures: dict[str, Future[float]] = {}
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        for stage_name, (loader, file_name, prerequisites) in stages.items():
+            waits_for = [futures[name] for name in prerequisites]
+            futures[stage_name] = executor.submit(
+                _run_loading_stage,
+                db, loader, directory / file_name.name, waits_for
+            )
+
+    for stage_name, future in futures.items():
+        seconds = future.result()
+        print(f"  Loaded {stage_name} in {seconds:.3f}s")
+
+    return db
+
 
-    _load_facilities_data(db, FACILITIES_FILE_NAME)
-    _load_products_data(db, PRODUCTS_FILE_NAME)
-    _load_recipes_data(db, RECIPES_FILE_NAME)
-    _load_rates_data(db, RATES_FILE_NAME)
+######################################
+# Layered DataBase Loading Functions #
+######################################
 
+# A stack of data directories starts with the base game and then adds mods
+# Every layer directory may hold any of the usual four data files, plus a
+# removals file listing the names of things to take away from the layers
+# beneath it (by keys "facility categories", "facilities", "products", and
+# "recipes"). Removals happen first, so a layer can replace anything from a
+# lower layer by removing it and then defining it again in its own files.
+# Anything still using a removed product or facility category once the layer
+# has loaded is an error, so nothing is ever left pointing at a removed item.
+
+def _load_removals_data(db: DataBase, toml_file_name: Path) -> DataBase:
+    with open(toml_file_name, "rb") as f:
+        toml_table = tomllib.load(f)
+
+    for fc_name in toml_table.get("facility categories", []):
+        fc = FacilityCategory(fc_name)
+        if fc not in db.facility_categories:
+            raise ValueError(f"unknown facility category: {fc.name!r}")
+        db.facility_categories.discard(fc)
+
+        # Facilities can't outlive their category, so they go along with it
+        for facility in list(db.lookup_table_facilities.get(fc, set())):
+            del db.facilities[facility.name]
+
+    for f_name in toml_table.get("facilities", []):
+        if f_name not in db.facilities:
+            raise ValueError(f"unknown facility name: {f_name!r}")
+        del db.facilities[f_name]
+
+    for p_name in toml_table.get("products", []):
+        p = Product(p_name)
+        if p not in db.products:
+            raise ValueError(f"unknown product name: {p.name!r}")
+        db.products.discard(p)
+
+    for r_name in toml_table.get("recipes", []):
+        if r_name not in db.recipes:
+            raise ValueError(f"unknown recipe name: {r_name!r}")
+        del db.recipes[r_name]
+
+    return db
+
+
+# Recipes (and facilities) that use a removed product or facility category
+# would be left dangling, unless the layer defines it again in its own files
+# or removes them too, so this check runs once the whole layer has loaded
+def _check_removals_data(db: DataBase, toml_file_name: Path) -> DataBase:
+    with open(toml_file_name, "rb") as f:
+        toml_table = tomllib.load(f)
+
+    gone_categories = set(
+        fc for fc in map(
+            FacilityCategory, toml_table.get("facility categories", [])
+        )
+        if fc not in db.facility_categories
+    )
+    gone_products = set(
+        p for p in map(Product, toml_table.get("products", []))
+        if p not in db.products
+    )
+    if len(gone_categories) == 0 and len(gone_products) == 0:
+        return db
+
+    dangling_facilities = sorted(
+        f.name for f in db.facilities.values()
+        if f.category in gone_categories
+    )
+    if len(dangling_facilities) > 0:
+        names = ", ".join(repr(name) for name in dangling_facilities)
+        raise ValueError(
+            f"facilities still use removed facility categories: {names}"
+        )
+
+    dangling_recipes = sorted(
+        r.name for r in db.recipes.values()
+        if r.made_in in gone_categories or any(
+            q.product in gone_products for q in r.outputs + r.inputs
+        )
+    )
+    if len(dangling_recipes) > 0:
+        names = ", ".join(repr(name) for name in dangling_recipes)
+        raise ValueError(
+            f"recipes still use removed products or facility categories: "
+            f"{names}"
+        )
+
+    return db
+
+
+def load_database_layer(
+    base: DataBase,
+    directory: Path
+) -> LayeredDataBase:
+    print(f"Loading DataBase layer from {directory}...", end="", flush=True)
+    db = LayeredDataBase(base)
+
+    layer_loaders: list[tuple[DataLoader, Path]] = [
+        (_load_removals_data, REMOVALS_FILE_NAME),
+        (_load_facilities_data, FACILITIES_FILE_NAME),
+        (_load_products_data, PRODUCTS_FILE_NAME),
+        (_load_recipes_data, RECIPES_FILE_NAME),
+        (_load_rates_data, RATES_FILE_NAME),
+    ]
+    for loader, file_name in layer_loaders:
+        layer_file_name = directory / file_name.name
+        if layer_file_name.exists():
+            loader(db, layer_file_name)
+
+    removals_file_name = directory / REMOVALS_FILE_NAME.name
+    if removals_file_name.exists():
+        _check_removals_data(db, removals_file_name)
+
+    print(" done!")
+    db.make_tables()
+    return db
+
+
+# The first directory is the base game, and each one after it is a layer
+def load_database_stack(directories: list[Path]) -> DataBase:
+    if len(directories) == 0:
+        raise ValueError("need at least one data directory to load")
+
+    db = load_database(DataBase(), directory=directories[0])
+    db.make_tables()
+    for directory in directories[1:]:
+        db = load_database_layer(db, directory)
+    return db
+
+
+##########################################
+# Incremental Recipe Reloading Functions #
+##########################################
+
+# Only blocks whose hashes aren't already known get parsed, so the cost of a
+# reload scales with the size of the edit (plus one hashing pass over the file)
+# The lookup tables are patched in place, so call this after make_tables()
+# Products and facilities are assumed unchanged, since abbreviations resolve
+# against them; watch_game_data() does a full reload when they change instead
+# If a lock is given, it's only held while the DataBase is actually patched,
+# so threads reading the DataBase under the same lock never see half an edit
+
+# Returns the number of recipes removed and added (a changed block is both)
+def reload_recipes(
+    db: DataBase,
+    data_file_name: Path = RECIPES_FILE_NAME,
+    lock: AbstractContextManager[Any] | None = None
+) -> tuple[int, int]:
+    kept_hashes: set[str] = set()
+    new_blocks: dict[str, list[str]] = {}
+    repeated_hashes: list[str] = []
+
+    for recipe_block in iter_recipe_blocks(data_file_name):
+        block_hash = recipe_block_hash(recipe_block)
+        if block_hash in kept_hashes or block_hash in new_blocks:
+            repeated_hashes.append(block_hash)
+        elif block_hash in db.recipe_block_hashes:
+            kept_hashes.add(block_hash)
+        else:
+            new_blocks[block_hash] = recipe_block
+
+    # Parse and check everything before touching the DataBase at all, so that
+    # a bad edit to the file leaves the DataBase just how it was
+    new_recipes = [
+        read_recipe(recipe_block) for recipe_block in resolve_recipe_blocks(
+            new_blocks.values(), db, _abbreviations_file_name(data_file_name)
+        )
+    ]
+    hash_to_name = dict(db.recipe_block_hashes)
+    hash_to_name.update(
+        (block_hash, r.name) for block_hash, r in zip(new_blocks, new_recipes)
+    )
+
+    if len(repeated_hashes) > 0:
+        raise ValueError(
+            f"duplicate recipe name: {hash_to_name[repeated_hashes[0]]!r}"
+        )
+    remaining_names = set(hash_to_name[h] for h in kept_hashes)
+    for r in new_recipes:
+        if r.name in remaining_names:
+            raise ValueError(f"duplicate recipe name: {r.name!r}")
+        remaining_names.add(r.name)
+
+    with lock if lock is not None else nullcontext():
+        removed_hashes = [
+            block_hash for block_hash in db.recipe_block_hashes
+            if block_hash not in kept_hashes
+        ]
+        for block_hash in removed_hashes:
+            db.remove_recipe(db.recipe_block_hashes.pop(block_hash))
+
+        for block_hash, r in zip(new_blocks, new_recipes):
+            db.add_recipe(r)
+            db.recipe_block_hashes[block_hash] = r.name
+
+    return len(removed_hashes), len(new_recipes)
+
+
+# Poll the game data files for changes until stop is set (or forever)
+# This blocks, so run it on its own thread to keep a DataBase up to date
+# Every change to db happens while holding lock, so other threads must hold
+# the same lock while they use db, or they could see it halfway through an
+# update. Files are read and parsed before taking the lock, so it's only
+# held for the quick swap at the end.
+def watch_game_data(
+    db: DataBase,
+    lock: AbstractContextManager[Any],
+    poll_seconds: float = 1.0,
+    stop: threading.Event | None = None
+) -> None:
+    if stop is None:
+        stop = threading.Event()
+
+    def modification_times() -> dict[Path, int]:
+        return {
+            file_name: file_name.stat().st_mtime_ns
+            for file_name in GAME_DATA_FILE_NAMES
+        }
+
+    last_seen = modification_times()
+    while not stop.wait(poll_seconds):
+        try:
+            current = modification_times()
+        except OSError:
+            continue  # Probably caught an editor in the middle of saving
+        if current == last_seen:
+            continue
+        changed = set(f for f in current if current[f] != last_seen[f])
+        last_seen = current
+
+        try:
+            if changed == {RECIPES_FILE_NAME}:
+                removed, added = reload_recipes(db, lock=lock)
+                print(f"Reloaded recipes: {removed} removed, {added} added")
+            else:
+                fresh_db = load_database(DataBase())
+                fresh_db.make_tables()
+                with lock:
+                    vars(db).update(vars(fresh_db))
+        except (OSError, ValueError) as e:
+            print(f"Unable to reload game data: {e}")
+
+
+###############################
+# DataBase Snapshot Functions #
+###############################
+
+# A snapshot is two pickles in a row: a small header, then the DataBase state
+# The header holds content hashes of the game data files and of the project's
+# own source files, so editing any data file or changing any of the classes
+# that get pickled (even just at the class level) makes the old snapshot stale
+# without any manual versioning
+# Only the header is read when the snapshot turns out to be stale
+
+SNAPSHOT_FORMAT_VERSION: int = 2
+
+SOURCE_DIRECTORY: Path = Path(__file__).resolve().parent
+
+
+def _source_hash() -> str:
+    source_hasher = hashlib.sha256()
+    for source_file_name in sorted(SOURCE_DIRECTORY.glob("*.py")):
+        source_hasher.update(source_file_name.name.encode("utf-8"))
+        source_hasher.update(source_file_name.read_bytes())
+    return source_hasher.hexdigest()
+
+
+def _snapshot_header() -> dict[str, Any]:
+    file_hashes: dict[str, str] = {}
+    for file_name in GAME_DATA_FILE_NAMES:
+        with open(file_name, "rb") as f:
+            file_hashes[file_name.name] = hashlib.sha256(f.read()).hexdigest()
+
+    return {
+        "version": SNAPSHOT_FORMAT_VERSION,
+        "layout": sorted(vars(DataBase())),
+        "source": _source_hash(),
+        "files": file_hashes,
+    }
+
+
+# Returns whether the snapshot was used, leaving db untouched if it wasn't
+# A snapshot pickled by older code can fail to unpickle in all sorts of ways
+# (AttributeError, TypeError, ModuleNotFoundError, ...), and any of them just
+# means doing a full load instead, so every exception is caught here
+def load_database_snapshot(db: DataBase) -> bool:
+    try:
+        header = _snapshot_header()
+        with open(SNAPSHOT_FILE_NAME, "rb") as f:
+            if pickle.load(f) != header:
+                return False
+            state = pickle.load(f)
+    except Exception:
+        return False
+    if not isinstance(state, dict):
+        return False
+
+    print("Loading DataBase from snapshot...", end="", flush=True)
+    vars(db).update(state)
     print(" done!")
+    return True
+
+
+def save_database_snapshot(db: DataBase) -> DataBase:
+    try:
+        header = _snapshot_header()
+        with open(SNAPSHOT_FILE_NAME, "wb") as f:
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(vars(db), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass  # Snapshots only save time, so failing to write one is fine
     return db
@@ -1,9 +1,14 @@
 # databases.py
 # Database type for reading, storing, and supplying all forms of DSP game data
 
+from types import MappingProxyType
+
+from compiled_databases import CompiledDataBase
 from facilities import FacilityCategory, Facility
-from products import Product
-from rates import Rate, Time
+from products import Product, ProductQuantity
+from rates import Rate, RateScale, Time
+from raw_costs import RawCostTable
+from recipe_graphs import RecipeGraph
 from recipes import Recipe
 
 
@@ -23,6 +28,66 @@ class DataBase:
         self.lookup_table_facilities: dict[FacilityCategory, set[Facility]] = {}
         self.lookup_table_recipes: dict[Product, set[Recipe]] = {}
 
+        # These tables hold frozensets, so queries can hand them out directly
+        self.lookup_table_consumers: dict[Product, frozenset[Recipe]] = {}
+        self.lookup_table_made_in: dict[
+            FacilityCategory, frozenset[Recipe]
+        ] = {}
+
+        # Content hash of each recipe block in the data file => recipe name
+        self.recipe_block_hashes: dict[str, str] = {}
+
+        # Name => the one canonical instance of that product or category
+        self.interned_products: dict[str, Product] = {}
+        self.interned_categories: dict[str, FacilityCategory] = {}
+
+        # Derived views of the data, built on demand and dropped on changes
+        self._compiled: CompiledDataBase | None = None
+        self._recipe_graph: RecipeGraph | None = None
+        self._raw_cost_table: RawCostTable | None = None
+        self._craftable_products: frozenset[Product] | None = None
+        self._unit_rates: dict[str, dict[Product, Rate]] = {}
+
+    ##############################
+    # Canonical Object Interning #
+    ##############################
+
+    # Everything stored in the DataBase should go through these first, so
+    # that each name maps to exactly one object and most equality checks in
+    # dict and set lookups can stop at an identity comparison
+
+    def intern_product(self, product: Product | str) -> Product:
+        if not isinstance(product, Product):
+            product = Product(product)
+        return self.interned_products.setdefault(product.name, product)
+
+    def intern_category(
+        self,
+        category: FacilityCategory | str
+    ) -> FacilityCategory:
+        if not isinstance(category, FacilityCategory):
+            category = FacilityCategory(category)
+        return self.interned_categories.setdefault(category.name, category)
+
+    # Returns the same recipe when nothing in it needed replacing
+    def intern_recipe(self, recipe: Recipe) -> Recipe:
+        quantities = recipe.outputs + recipe.inputs
+        if recipe.made_in is self.intern_category(recipe.made_in) and all(
+            q.product is self.intern_product(q.product) for q in quantities
+        ):
+            return recipe
+
+        def intern_quantity(q: ProductQuantity[int]) -> ProductQuantity[int]:
+            return ProductQuantity(q.quantity, self.intern_product(q.product))
+
+        return Recipe(
+            recipe.name,
+            [intern_quantity(q) for q in recipe.outputs],
+            [intern_quantity(q) for q in recipe.inputs],
+            recipe.period,
+            self.intern_category(recipe.made_in),
+        )
+
     ###############################
     # Lookup Table Initialization #
     ###############################
@@ -42,31 +107,228 @@ class DataBase:
                 self.lookup_table_recipes[quantity.product].add(recipe)
         return self
 
+    # Recipes by input product, i.e., the reverse of lookup_table_recipes
+    def _make_table_consumers(self) -> 'DataBase':
+        consumers: dict[Product, set[Recipe]] = {}
+        for recipe in self.recipes.values():
+            for quantity in recipe.inputs:
+                if quantity.product not in consumers:
+                    consumers[quantity.product] = set()
+                consumers[quantity.product].add(recipe)
+        for product, recipes in consumers.items():
+            self.lookup_table_consumers[product] = frozenset(recipes)
+        return self
+
+    def _make_table_made_in(self) -> 'DataBase':
+        made_in: dict[FacilityCategory, set[Recipe]] = {}
+        for recipe in self.recipes.values():
+            if recipe.made_in not in made_in:
+                made_in[recipe.made_in] = set()
+            made_in[recipe.made_in].add(recipe)
+        for category, recipes in made_in.items():
+            self.lookup_table_made_in[category] = frozenset(recipes)
+        return self
+
     def make_tables(self) -> 'DataBase':
         print("Making lookup tables for DataBase...", end="", flush=True)
+        self._invalidate_derived()
         self._make_table_facilities()
         self._make_table_recipes()
+        self._make_table_consumers()
+        self._make_table_made_in()
         print(" done!")
         return self
 
+    #####################################
+    # Incremental DataBase Modification #
+    #####################################
+
+    # These keep the lookup tables in sync, so they're for use after
+    # make_tables() has run (e.g. when reloading an edited recipe file)
+
+    # Frozen table entries get replaced rather than modified in place
+    def _add_to_frozen_tables(self, recipe: Recipe) -> None:
+        for quantity in recipe.inputs:
+            consumers = self.lookup_table_consumers.get(
+                quantity.product, frozenset()
+            ) | {recipe}
+            self.lookup_table_consumers[quantity.product] = consumers
+        made_in = self.lookup_table_made_in.get(recipe.made_in, frozenset())
+        self.lookup_table_made_in[recipe.made_in] = made_in | {recipe}
+
+    def _remove_from_frozen_tables(self, recipe: Recipe) -> None:
+        for quantity in recipe.inputs:
+            consumers = self.lookup_table_consumers.get(
+                quantity.product, frozenset()
+            ) - {recipe}
+            if len(consumers) > 0:
+                self.lookup_table_consumers[quantity.product] = consumers
+            elif quantity.product in self.lookup_table_consumers:
+                del self.lookup_table_consumers[quantity.product]
+        made_in = self.lookup_table_made_in.get(
+            recipe.made_in, frozenset()
+        ) - {recipe}
+        if len(made_in) > 0:
+            self.lookup_table_made_in[recipe.made_in] = made_in
+        elif recipe.made_in in self.lookup_table_made_in:
+            del self.lookup_table_made_in[recipe.made_in]
+
+    def add_recipe(self, recipe: Recipe) -> 'DataBase':
+        if recipe.name in self.recipes:
+            raise ValueError(f"duplicate recipe name: {recipe.name!r}")
+
+        recipe = self.intern_recipe(recipe)
+        self._invalidate_derived()
+        self.recipes[recipe.name] = recipe
+        for quantity in recipe.outputs:
+            if quantity.product not in self.lookup_table_recipes:
+                self.lookup_table_recipes[quantity.product] = set()
+            self.lookup_table_recipes[quantity.product].add(recipe)
+        self._add_to_frozen_tables(recipe)
+        return self
+
+    def remove_recipe(self, recipe_name: str) -> Recipe:
+        if recipe_name not in self.recipes:
+            raise ValueError(f"unknown recipe name: {recipe_name!r}")
+
+        self._invalidate_derived()
+        recipe = self.recipes.pop(recipe_name)
+        for quantity in recipe.outputs:
+            producers = self.lookup_table_recipes.get(quantity.product, set())
+            producers.discard(recipe)
+            if len(producers) == 0:
+                self.lookup_table_recipes.pop(quantity.product, None)
+        self._remove_from_frozen_tables(recipe)
+        return recipe
+
+    # Anything that changes the DataBase contents must call this
+    def _invalidate_derived(self) -> None:
+        self._compiled = None
+        self._recipe_graph = None
+        self._raw_cost_table = None
+        self._craftable_products = None
+        self._unit_rates = {}
+
+    ###########################
+    # Compiled DataBase Views #
+    ###########################
+
+    # See compiled_databases.py, this is rebuilt after any change to the data
+    def compile(self) -> CompiledDataBase:
+        if self._compiled is None:
+            self._compiled = CompiledDataBase(
+                self.products, self.recipes.values(), self.facilities.values()
+            )
+        return self._compiled
+
+    # Read-only, so every crafter of the recipe can share the same one
+    # The cache holds plain dicts, since snapshots can't pickle the proxies
+    def unit_rates(
+        self,
+        recipe: Recipe | str
+    ) -> MappingProxyType[Product, Rate]:
+        name = recipe.name if isinstance(recipe, Recipe) else recipe
+        if name not in self._unit_rates:
+            if name not in self.recipes:
+                raise ValueError(f"unknown recipe name: {name!r}")
+            self._unit_rates[name] = self.recipes[name].unit_rates()
+        return MappingProxyType(self._unit_rates[name])
+
+    # Every product that at least one recipe makes
+    def craftable_products(self) -> frozenset[Product]:
+        if self._craftable_products is None:
+            self._craftable_products = frozenset(self.lookup_table_recipes)
+        return self._craftable_products
+
+    # See RateScale in rates.py, for fast fixed-denominator rate math
+    def rate_scale(self) -> RateScale:
+        return self.compile().rate_scale
+
+    # See recipe_graphs.py, this is rebuilt after any change to the data
+    def recipe_graph(self) -> RecipeGraph:
+        if self._recipe_graph is None:
+            self._recipe_graph = RecipeGraph(self.compile())
+        return self._recipe_graph
+
+    # See raw_costs.py, this uses the default recipe policy
+    # Build a RawCostTable from recipe_graph() directly for any other policy
+    def raw_cost_table(self) -> RawCostTable:
+        if self._raw_cost_table is None:
+            self._raw_cost_table = RawCostTable(self.recipe_graph())
+        return self._raw_cost_table
+
+    # What it takes in raw materials to make the product at the given rate
+    def raw_cost(
+        self,
+        product: Product | str,
+        rate: Rate
+    ) -> dict[Product, Rate]:
+        return self.raw_cost_table().raw_cost(product, rate)
+
     ############################
     # DataBase Query Functions #
     ############################
 
+    # Names that were never interned can't be in any lookup table
+    def _find_product(self, product: Product | str) -> Product | None:
+        if isinstance(product, Product):
+            return product
+        return self.interned_products.get(product.strip())
+
+    def _find_category(
+        self,
+        category: FacilityCategory | str | Facility | Recipe
+    ) -> FacilityCategory | None:
+        if isinstance(category, str):
+            return self.interned_categories.get(category.strip())
+        elif isinstance(category, (Facility, Recipe)):
+            return category.category
+        return category
+
     def find_facilities(
         self,
         category: FacilityCategory | str | Recipe
     ) -> set[Facility]:
-        if isinstance(category, str):
-            category = FacilityCategory(category)
-        elif isinstance(category, Recipe):
-            category = category.category
-        return self.lookup_table_facilities.get(category, set())
+        found_category = self._find_category(category)
+        if found_category is None:
+            return set()
+        return self.lookup_table_facilities.get(found_category, set())
 
     def find_recipes(
         self,
         recipe_output: Product | str
     ) -> set[Recipe]:
-        if not isinstance(recipe_output, Product):
-            recipe_output = Product(recipe_output)
-        return self.lookup_table_recipes.get(recipe_output, set())
+        product = self._find_product(recipe_output)
+        if product is None:
+            return set()
+        return self.lookup_table_recipes.get(product, set())
+
+    def find_consumers(
+        self,
+        recipe_input: Product | str
+    ) -> frozenset[Recipe]:
+        product = self._find_product(recipe_input)
+        if product is None:
+            return frozenset()
+        return self.lookup_table_consumers.get(product, frozenset())
+
+    def find_recipes_made_in(
+        self,
+        category: FacilityCategory | str | Facility
+    ) -> frozenset[Recipe]:
+        found_category = self._find_category(category)
+        if found_category is None:
+            return frozenset()
+        return self.lookup_table_made_in.get(found_category, frozenset())
+
+    # Recipes that turn one product into another, e.g. Hydrogen => Graphene
+    def find_converters(
+        self,
+        recipe_input: Product | str,
+        recipe_output: Product | str
+    ) -> frozenset[Recipe]:
+        consumers = self.find_consumers(recipe_input)
+        producers = self.find_recipes(recipe_output)
+        if len(consumers) <= len(producers):
+            return frozenset(r for r in consumers if r in producers)
+        return frozenset(r for r in producers if r in consumers)
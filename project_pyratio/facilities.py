@@ -1,7 +1,7 @@
 # facilities.py
 # Types for representing production buildings and building classes from DSP
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from fractions import Fraction
 
 from rational_utilities import pretty_string
@@ -11,14 +11,31 @@ from rational_utilities import pretty_string
 # FacilityCategory Type Implementation #
 ########################################
 
+# Hashing and equality work just like they do for Product (see products.py)
 @dataclass(init=False, frozen=True, slots=True)
 class FacilityCategory:
     name: str
+    _hash: int = field(repr=False, compare=False)
 
     def __init__(self, name: str) -> None:
         object.__setattr__(self, "name", name.strip())
         if self.name == "":
             raise ValueError("facility category name empty or all whitespace")
+        object.__setattr__(self, "_hash", hash(self.name))
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if other.__class__ is not FacilityCategory:
+            return NotImplemented
+        assert isinstance(other, FacilityCategory)
+        return self._hash == other._hash and self.name == other.name
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __reduce__(self) -> tuple[type['FacilityCategory'], tuple[str]]:
+        return (FacilityCategory, (self.name,))
 
     def __str__(self) -> str:
         return self.name
@@ -1,15 +1,25 @@
 # factories.py
 # Data types for a DSP factory and the groups of producers that make it up
 
+from collections.abc import Iterable, Iterator, Mapping
+from enum import Enum
 from fractions import Fraction
+from heapq import heapify, heappop, heappush
+from types import MappingProxyType
 
+from databases import DataBase
 from facilities import Facility
 from products import Product, ProductQuantity
-from rates import Rate
+from rate_vectors import NumericMode, RateVector
+from rates import Rate, RateScale
 from rational_utilities import pretty_string
 from recipes import Recipe
 
 
+# When true, every Factory change gets checked against a full recomputation
+VERIFY_RATE_UPDATES: bool = False
+
+
 #####################################
 # RecipeCrafter Type Implementation #
 #####################################
@@ -23,11 +33,13 @@ class RecipeCrafter:
         self,
         recipe: Recipe,
         facility: Facility,
-        how_many: Fraction | int | float
+        how_many: Fraction | int | float,
+        unit_rates: Mapping[Product, Rate] | None = None
     ) -> None:
         if how_many <= 0 :
             raise ValueError("RecipeProducer should not have howmany <= 0")
 
+        self._rates = _ScaledRates(self)
         self.recipe = recipe
         self.facility = facility
         self.how_many = Fraction(how_many)  # int in DSP terms
@@ -36,7 +48,10 @@ class RecipeCrafter:
         #::Proliferator
         #::ProliferationMode
 
-        self._rates: dict[Product, Rate] = {}
+        # Use DataBase.unit_rates() to share one of these between crafters
+        if unit_rates is None:
+            unit_rates = MappingProxyType(recipe.unit_rates())
+        self.unit_rates = unit_rates
 
     # This constructor takes a production rate and computes the value of howmany
     @classmethod
@@ -44,10 +59,12 @@ class RecipeCrafter:
         cls,
         recipe: Recipe,
         facility: Facility,
-        goal: ProductQuantity[Rate]
+        goal: ProductQuantity[Rate],
+        unit_rates: Mapping[Product, Rate] | None = None
     ) -> 'RecipeCrafter':
         p, rate = goal.product, goal.quantity
-        rc = RecipeCrafter(recipe, facility, 1)  # Temp value of howmany == 1
+        # Temp value of howmany == 1
+        rc = RecipeCrafter(recipe, facility, 1, unit_rates)
 
         if p not in rc.rates or rc.rates[p] <= Rate.zero():
             raise ValueError("given recipe does not produce goal product")
@@ -58,41 +75,54 @@ class RecipeCrafter:
 
         # TODO: consider proliferation of the recipe crafter
 
-        rc._compute_rates()
         return rc
 
-    # Note: this function needs to be careful about not overwriting Dict entries
-    # For example, X-Ray Cracking has Hydrogen inputs *and* outputs to account for
-    # Use get!() here so the output rate will not be overwritten by the input rate
-    def _compute_rates(self) -> dict[Product, Rate]:
-        self._rates.clear()
+    # TODO: proliferation would affect all these recipe rates
+    # *and* it would consume proliferator product at a certain rate
+
+    # Changing how_many has to drop the scaled rates cached in self.rates
+    @property
+    def how_many(self) -> Fraction:
+        return self._how_many
+
+    @how_many.setter
+    def how_many(self, how_many: Fraction | int | float) -> None:
+        if how_many <= 0:
+            raise ValueError("RecipeProducer should not have howmany <= 0")
+        self._how_many = Fraction(how_many)
+        self._rates.clear_cache()
+
+    @property
+    def multiplier(self) -> Fraction:
+        return self.facility.speed * self.how_many
+
+    # A live view of unit_rates * multiplier, so it follows how_many changes
+    @property
+    def rates(self) -> Mapping[Product, Rate]:
+        return self._rates
+
+    # Same as rates, but in integer units of the given RateScale, which must
+    # fit the facility speed * how_many / recipe period of this crafter
+    # Only that one Fraction gets computed, everything else is int math
+    def fixed_rates(self, scale: RateScale) -> dict[Product, int]:
+        units_per_quantity = scale.units(
+            self.facility.speed * self.how_many / self.recipe.period.seconds
+        )
+        fixed_rates: dict[Product, int] = {}
 
         for output in self.recipe.outputs:
-            recipe_rate = output.quantity / self.recipe.period
-            total_rate = recipe_rate * self.facility.speed * self.how_many
-            assert isinstance(total_rate, Rate)
-            self._rates[output.product] = (
-                self._rates.get(output.product, Rate.zero()) + total_rate
+            fixed_rates[output.product] = (
+                fixed_rates.get(output.product, 0)
+                + output.quantity * units_per_quantity
             )
 
         for input_ in self.recipe.inputs:
-            recipe_rate = input_.quantity / self.recipe.period
-            total_rate = recipe_rate * self.facility.speed * self.how_many
-            assert isinstance(total_rate, Rate)
-            self._rates[input_.product] = (
-                self._rates.get(input_.product, Rate.zero()) - total_rate
+            fixed_rates[input_.product] = (
+                fixed_rates.get(input_.product, 0)
+                - input_.quantity * units_per_quantity
             )
 
-        # TODO: proliferation would affect all these recipe rates
-        # *and* it would consume proliferator product at a certain rate
-
-        return self._rates
-
-    @property
-    def rates(self) -> dict[Product, Rate]:
-        if len(self._rates) == 0:
-            self._compute_rates()
-        return self.rates
+        return fixed_rates
 
     def __str__(self) -> str:
         parts: list[str] = []
@@ -104,25 +134,261 @@ class RecipeCrafter:
         parts.append(self.recipe.name)
         return "".join(parts)
 
+
+# Each rate is scaled the first time it's looked up, then kept until the
+# crafter's how_many changes (see RecipeCrafter.how_many above)
+class _ScaledRates(Mapping[Product, Rate]):
+
+    def __init__(self, crafter: RecipeCrafter) -> None:
+        self.crafter = crafter
+        self._cache: dict[Product, Rate] = {}
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def __getitem__(self, product: Product) -> Rate:
+        rate = self._cache.get(product)
+        if rate is None:
+            rate = self.crafter.unit_rates[product] * self.crafter.multiplier
+            assert isinstance(rate, Rate)
+            self._cache[product] = rate
+        return rate
+
+    def __iter__(self) -> Iterator[Product]:
+        return iter(self.crafter.unit_rates)
+
+    def __len__(self) -> int:
+        return len(self.crafter.unit_rates)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+
+##################################
+# GapTracker Type Implementation #
+##################################
+
+# Which open deficit should get worked on first: the biggest one, or the one
+# deepest in the recipe graph (i.e., furthest from the raw materials), which
+# expands a factory top-down so each product's consumers are all in place
+class GapOrder(Enum):
+    MAGNITUDE = "magnitude"
+    DEPTH = "depth"
+
+
+# Priority, push count, product, and rate of the gap when it was pushed
+_GapEntry = tuple[tuple[int, Fraction], int, Product, Rate]
+
+
+# Keeps the production gaps of a Factory (negative rates of products that some
+# recipe can make, which are not ignored) up to date as the rates change
+# Gaps sit in a heap where stale entries are just skipped when they come up,
+# so each update is O(log n), and so is finding the next gap to work on
+# Once stale entries outnumber live gaps, the heap gets rebuilt without them
+class GapTracker:
+
+    def __init__(self, db: DataBase, order: GapOrder) -> None:
+        self.order = order
+        self.craftable = db.craftable_products()
+
+        graph = db.recipe_graph()
+        self._depths: dict[Product, int] = {
+            product: graph.component_depths[graph.component_of[product_id]]
+            for product, product_id in graph.compiled.product_ids.items()
+        }
+
+        self.gaps: dict[Product, Rate] = {}
+        self._heap: list[_GapEntry] = []
+        self._pushes = 0  # Tie breaker, so the heap never compares products
+
+        # Negative rates of products with no recipe at all, not yet ignored
+        self.uncraftable: dict[Product, Rate] = {}
+
+        # Products that became gaps or stopped being gaps since last checked
+        self.changed: set[Product] = set()
+
+    def _priority(self, product: Product, rate: Rate) -> tuple[int, Fraction]:
+        if self.order == GapOrder.DEPTH:
+            return (-self._depths.get(product, 0), rate.per_second)
+        return (0, rate.per_second)
+
+    def clear(self) -> 'GapTracker':
+        self.changed.update(self.gaps)
+        self.gaps.clear()
+        self._heap.clear()
+        self.uncraftable.clear()
+        return self
+
+    def update(
+        self,
+        product: Product,
+        rate: Rate | None,
+        ignored: bool
+    ) -> 'GapTracker':
+        is_deficit = rate is not None and rate < Rate.zero() and not ignored
+        is_gap = is_deficit and product in self.craftable
+
+        if is_gap != (product in self.gaps):
+            self.changed.add(product)
+
+        if is_gap:
+            assert rate is not None
+            if self.gaps.get(product) != rate:
+                self.gaps[product] = rate
+                heappush(self._heap, (
+                    self._priority(product, rate), self._pushes, product, rate
+                ))
+                self._pushes += 1
+        else:
+            self.gaps.pop(product, None)
+
+        if is_deficit and not is_gap:
+            assert rate is not None
+            self.uncraftable[product] = rate
+        else:
+            self.uncraftable.pop(product, None)
+
+        if len(self._heap) > 2 * len(self.gaps):
+            self._compact()
+        return self
+
+    # Keeps the oldest live entry of each gap, so ties still break the same
+    def _compact(self) -> None:
+        live: dict[Product, _GapEntry] = {}
+        for entry in self._heap:
+            _, pushes, product, rate = entry
+            if self.gaps.get(product) != rate:
+                continue
+            if product not in live or pushes < live[product][1]:
+                live[product] = entry
+        self._heap = list(live.values())
+        heapify(self._heap)
+
+    def next_gap(self) -> ProductQuantity[Rate] | None:
+        while len(self._heap) > 0:
+            _, _, product, rate = self._heap[0]
+            if self.gaps.get(product) == rate:
+                return ProductQuantity(-rate, product)
+            heappop(self._heap)
+        return None
+
+    def take_changes(self) -> set[Product]:
+        changed = self.changed
+        self.changed = set()
+        return changed
+
+
 ###############################
 # Factory Type Implementation #
 ###############################
 
+# Net quantity of each product that a crafter makes (> 0) or uses (< 0)
+# Every product in the recipe shows up, in recipe order, even if it nets to 0
+def _crafter_net_quantities(rc: RecipeCrafter) -> dict[Product, int]:
+    net_quantities: dict[Product, int] = {}
+    for output in rc.recipe.outputs:
+        net_quantities[output.product] = (
+            net_quantities.get(output.product, 0) + output.quantity
+        )
+    for input_ in rc.recipe.inputs:
+        net_quantities[input_.product] = (
+            net_quantities.get(input_.product, 0) - input_.quantity
+        )
+    return net_quantities
+
+
+# Passing in the DataBase lets rates be added up in fixed-denominator integer
+# units (see RateScale in rates.py), instead of with Fractions all the way
+# The sums then happen all at once in a RateVector (see rate_vectors.py)
+# The numeric mode can switch those sums to float64, see NumericMode there
+# The DataBase also lets the Factory keep track of its production gaps
 class Factory:
 
-    def __init__(self, goal: ProductQuantity[Rate]) -> None:
+    def __init__(
+        self,
+        goal: ProductQuantity[Rate],
+        db: DataBase | None = None,
+        mode: NumericMode = NumericMode.EXACT,
+        gap_order: GapOrder = GapOrder.MAGNITUDE
+    ) -> None:
         self.goal = goal
-        self.crafters: list[RecipeCrafter] = []
+        self.mode = mode
+        # A dict as an insertion-ordered set, so lookups and disconnects of
+        # crafters don't have to scan through the whole factory
+        self.crafters: dict[RecipeCrafter, None] = {}
+        self.compiled = db.compile() if db is not None else None
+        self.base_scale = db.rate_scale() if db is not None else None
+        self.rate_vector: RateVector | None = None
+        self._scale: RateScale | None = None
 
         # TODO: output proflieration info for primary product
         #::Proliferator
 
         self._rates: dict[Product, Rate] = {}
 
+        # How many crafters (plus the goal) use each product in self._rates
+        self._product_uses: dict[Product, int] = {}
+
+        # Crafters with a net output (or net input) of each product, with
+        # dicts as insertion-ordered sets so they stay in connection order
+        # A crafter's rates all scale together, so upgrades never move it
+        self._producers: dict[Product, dict[RecipeCrafter, None]] = {}
+        self._consumers: dict[Product, dict[RecipeCrafter, None]] = {}
+
         # If true, ignore negative rates
         self.ignored_rates: dict[Product, bool] = {}
 
+        self.gap_tracker = (
+            GapTracker(db, gap_order) if db is not None else None
+        )
+
+        self._compute_rates()
+
+    # Common scale of all the rates in rate_vector, see RateScale in rates.py
+    def rate_scale(self) -> RateScale | None:
+        return self._scale
+
+    ##################################
+    # Full Factory Rate Computations #
+    ##################################
+
+    # These start over from nothing, while the changes to a Factory only
+    # apply the difference made by one crafter (see _apply_crafter() below)
+
     def _compute_rates(self) -> dict[Product, Rate]:
+        self._producers.clear()
+        self._consumers.clear()
+        for crafter in self.crafters:
+            self._index_crafter(crafter, True)
+
+        self._product_uses = {self.goal.product: 1}
+        for crafter in self.crafters:
+            for product in _crafter_net_quantities(crafter):
+                self._product_uses[product] = (
+                    self._product_uses.get(product, 0) + 1
+                )
+
+        self._sum_rates()
+
+        if self.gap_tracker is not None:
+            self.gap_tracker.clear()
+            for product in self._rates:
+                self._update_gap(product)
+        return self._rates
+
+    def _sum_rates(self) -> dict[Product, Rate]:
+        # The base scale fits every crafter's unit rates, so scaling it up by
+        # the how_many denominators and the goal denominator makes all fit
+        if self.base_scale is not None:
+            self._scale = self.base_scale.scaled_by(
+                self.goal.quantity.per_second.denominator,
+                *(crafter.how_many.denominator for crafter in self.crafters)
+            )
+            if self.mode == NumericMode.FLOAT:
+                if self._compute_float_rates(self._scale):
+                    return self._rates
+            return self._compute_fixed_rates(self._scale)
+
         self._rates.clear()
 
         self._rates[self.goal.product] = -self.goal.quantity
@@ -134,6 +400,155 @@ class Factory:
 
         return self._rates
 
+    def _compute_fixed_rates(self, scale: RateScale) -> dict[Product, Rate]:
+        assert self.compiled is not None
+        product_ids = self.compiled.product_ids
+
+        ids: list[int] = [self.compiled.product_id(self.goal.product)]
+        units: list[int] = [-scale.units(self.goal.quantity)]
+        for crafter in self.crafters:
+            for product, crafter_units in crafter.fixed_rates(scale).items():
+                ids.append(product_ids[product])
+                units.append(crafter_units)
+
+        self.rate_vector = RateVector.from_units(
+            len(self.compiled.products), scale, ids, units
+        )
+        return self._rates_from_vector(ids)
+
+    # Returns False when the float results couldn't be certified as exact
+    # Each term is certified at its own crafter's denominator, not at the
+    # shared scale, which gets too fine to certify with many crafters
+    def _compute_float_rates(self, scale: RateScale) -> bool:
+        assert self.compiled is not None
+        product_ids = self.compiled.product_ids
+
+        goal_rate = Fraction(self.goal.quantity.per_second)
+        ids: list[int] = [self.compiled.product_id(self.goal.product)]
+        terms: list[float] = [-float(goal_rate)]
+        denominators: list[int] = [goal_rate.denominator]
+        for crafter in self.crafters:
+            per_quantity = Fraction(
+                crafter.facility.speed * crafter.how_many
+                / crafter.recipe.period.seconds
+            )
+            float_per_quantity = float(per_quantity)
+            for output in crafter.recipe.outputs:
+                ids.append(product_ids[output.product])
+                terms.append(output.quantity * float_per_quantity)
+                denominators.append(per_quantity.denominator)
+            for input_ in crafter.recipe.inputs:
+                ids.append(product_ids[input_.product])
+                terms.append(-input_.quantity * float_per_quantity)
+                denominators.append(per_quantity.denominator)
+
+        vector = RateVector.from_float_terms(
+            len(self.compiled.products), scale, ids, terms, denominators
+        )
+        if vector is None:
+            return False
+        self.rate_vector = vector
+        self._rates_from_vector(ids)
+        return True
+
+    # Products with a net rate of zero still count as part of the factory
+    def _rates_from_vector(self, ids: list[int]) -> dict[Product, Rate]:
+        assert self.compiled is not None and self.rate_vector is not None
+        self._rates.clear()
+        for product_id in dict.fromkeys(ids):
+            product = self.compiled.products[product_id]
+            self._rates[product] = self.rate_vector.rate(product_id)
+        return self._rates
+
+    ########################################
+    # Incremental Factory Rate Maintenance #
+    ########################################
+
+    # Adds (sign 1) or takes away (sign -1) the rates of one crafter
+    # Only that crafter's products get touched, so building up a factory one
+    # crafter at a time costs time linear in its size, not quadratic
+    def _apply_crafter(self, rc: RecipeCrafter, sign: int) -> None:
+        unused: list[Product] = []
+        for product in _crafter_net_quantities(rc):
+            uses = self._product_uses.get(product, 0) + sign
+            if uses == 0:
+                del self._product_uses[product]
+                unused.append(product)
+            else:
+                self._product_uses[product] = uses
+
+        if self._scale is None:
+            for product, rate in rc.rates.items():
+                self._rates[product] = (
+                    self._rates.get(product, Rate.zero())
+                    + (rate if sign > 0 else -rate)
+                )
+        else:
+            self._apply_crafter_units(rc, sign)
+
+        for product in unused:
+            del self._rates[product]
+
+        if self.gap_tracker is not None:
+            for product in _crafter_net_quantities(rc):
+                self._update_gap(product)
+
+    def _update_gap(self, product: Product) -> None:
+        assert self.gap_tracker is not None
+        self.gap_tracker.update(
+            product,
+            self._rates.get(product),
+            self.ignored_rates.get(product, False)
+        )
+
+    def _apply_crafter_units(self, rc: RecipeCrafter, sign: int) -> None:
+        assert self.compiled is not None and self._scale is not None
+        assert self.rate_vector is not None
+
+        # The scale only ever gets finer, so any crafter already applied fits
+        per_quantity = (
+            rc.facility.speed * rc.how_many / rc.recipe.period.seconds
+        )
+        multiple = (per_quantity * self._scale.denominator).denominator
+        if multiple != 1:
+            self._scale = self._scale.scaled_by(multiple)
+            self.rate_vector = self.rate_vector.rescaled(self._scale)
+
+        ids: list[int] = []
+        units: list[int] = []
+        for product, crafter_units in rc.fixed_rates(self._scale).items():
+            ids.append(self.compiled.product_ids[product])
+            units.append(sign * crafter_units)
+        self.rate_vector.add_units(ids, units)
+
+        for product_id in ids:
+            product = self.compiled.products[product_id]
+            self._rates[product] = self.rate_vector.rate(product_id)
+
+    def _index_crafter(self, rc: RecipeCrafter, connect: bool) -> None:
+        for product, quantity in _crafter_net_quantities(rc).items():
+            if quantity == 0:
+                continue
+            index = self._producers if quantity > 0 else self._consumers
+
+            if connect:
+                if product not in index:
+                    index[product] = {}
+                index[product][rc] = None
+            else:
+                del index[product][rc]
+                if len(index[product]) == 0:
+                    del index[product]
+
+    # Debugging aid, raises ValueError if the incremental updates have drifted
+    # from what a full recomputation with plain Rate arithmetic gives
+    def verify_rates(self) -> 'Factory':
+        expected = Factory(self.goal)
+        expected.crafters = dict(self.crafters)
+        if expected._compute_rates() != self._rates:
+            raise ValueError("factory rates are out of sync with its crafters")
+        return self
+
     @property
     def rates(self) -> dict[Product, Rate]:
         if len(self._rates) == 0:
@@ -149,18 +564,28 @@ class Factory:
     # Ignored products have no recipe or they were shot down by the user
     def negative_rates(self) -> dict[Product, Rate]:
         negatives: dict[Product, Rate] = {}
-        for product, product_rate in self.rates.items():
+        rates = self.rates
+
+        if self.rate_vector is not None:
+            assert self.compiled is not None
+            for product_id in self.rate_vector.negative_ids():
+                product = self.compiled.products[product_id]
+                if not self.is_ignored(product):
+                    negatives[product] = rates[product]
+            return negatives
+
+        for product, product_rate in rates.items():
             if not self.is_ignored(product) and product_rate < Rate.zero():
                 negatives[product] = product_rate
         return negatives
 
     # Sometimes we need to know which crafters are producing a given product
     def find_crafters(self, p: Product) -> list[RecipeCrafter]:
-        crafters: list[RecipeCrafter] = []
-        for crafter in self.crafters:
-            if p in crafter.rates and crafter.rates[p] > Rate.zero():
-                crafters.append(crafter)
-        return crafters
+        return list(self._producers.get(p, {}))
+
+    # And the same goes for crafters consuming a given product
+    def find_consumers(self, p: Product) -> list[RecipeCrafter]:
+        return list(self._consumers.get(p, {}))
 
     def __str__(self) -> str:
         INDENT: str = " " * 2
@@ -208,20 +633,47 @@ class Factory:
         if p not in self.rates:
             raise ValueError("product must exist to be set as ignored")
         self.ignored_rates[p] = True
+        if self.gap_tracker is not None:
+            self._update_gap(p)
         return self
 
     def set_all_ignored(self) -> 'Factory':
         for product in self.rates:
             self.ignored_rates[product] = True
+        if self.gap_tracker is not None:
+            self.gap_tracker.clear()
         return self
 
     def connect_crafter(self, rc: RecipeCrafter) -> 'Factory':
         if rc in self.crafters:
             raise ValueError("cannot connect same crafter to a factory twice")
-        self.crafters.append(rc)
+        self.crafters[rc] = None
+        self._index_crafter(rc, True)
+        self._apply_crafter(rc, 1)
+        if VERIFY_RATE_UPDATES:
+            self.verify_rates()
+        return self
+
+    # Connects many crafters with one full recomputation, instead of one
+    # incremental update each, so the numeric mode applies to all of them
+    def connect_crafters(self, rcs: Iterable[RecipeCrafter]) -> 'Factory':
+        rcs = list(rcs)
+        if len(rcs) != len(set(rcs)) or any(rc in self.crafters for rc in rcs):
+            raise ValueError("cannot connect same crafter to a factory twice")
+        self.crafters.update(dict.fromkeys(rcs))
         self._compute_rates()
         return self
 
+    def disconnect_crafter(self, rc: RecipeCrafter) -> 'Factory':
+        if rc not in self.crafters:
+            raise ValueError("crafter must be factory-connected to disconnect")
+        del self.crafters[rc]
+        self._index_crafter(rc, False)
+        self._apply_crafter(rc, -1)
+        if VERIFY_RATE_UPDATES:
+            self.verify_rates()
+        return self
+
     def upgrade_crafter(
         self,
         rc: RecipeCrafter,
@@ -232,21 +684,22 @@ class Factory:
 
         if rc not in self.crafters:
             raise ValueError("crafter must be factory-connected to upgrade")
-        if target in rc.rates:
-            if rc.rates[target] <= Rate.zero():
-                raise ValueError(
-                    "upgrading crafter does not produce target product"
-                )
+        if target not in rc.rates or rc.rates[target] <= Rate.zero():
+            raise ValueError(
+                "upgrading crafter does not produce target product"
+            )
         if rc.rates[target] + delta_rate <= Rate.zero():
             raise ValueError("final upgraded crafter rate must be positive")
 
         upgrade_ratio = (rc.rates[target] + delta_rate) / rc.rates[target]
         assert isinstance(upgrade_ratio, Fraction)
+        self._apply_crafter(rc, -1)
         rc.how_many *= upgrade_ratio
 
         # TODO: consider how the proliferation of the crafter is to be upgraded
 
-        rc._compute_rates()
-        self._compute_rates()
+        self._apply_crafter(rc, 1)
+        if VERIFY_RATE_UPDATES:
+            self.verify_rates()
 
         return self
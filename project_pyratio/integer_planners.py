@@ -0,0 +1,387 @@
+# integer_planners.py
+# Whole numbers of facilities for a factory, by exact branch-and-bound
+
+from collections.abc import Callable, Collection
+from dataclasses import dataclass
+from fractions import Fraction
+from heapq import heappop, heappush
+from math import ceil, floor
+
+from databases import DataBase
+from facilities import Facility
+from factories import Factory, RecipeCrafter
+from optimizers import (
+    MINIMIZE_FACILITIES, Objective, candidate_recipes, raw_use
+)
+from products import Product, ProductQuantity
+from rate_vectors import NumericMode
+from rates import Rate
+from rational_linear_programming import (
+    ConstraintSense, LinearConstraint, minimize_linear_program
+)
+from rational_utilities import pretty_string
+from recipes import Recipe
+from solvers import ignore_raw_materials, intern_goal
+
+
+# Branch-and-bound gives up after solving this many LP relaxations, and then
+# settles for the best plan it found so far, which isn't proven optimal
+BRANCH_AND_BOUND_NODE_LIMIT: int = 2000
+
+# Rounding relaxed counts up into a plan gives up after adding this many more
+# facilities to patch up shortages (see _IntegerProgram.round_up() below)
+ROUNDING_REPAIR_LIMIT: int = 1000
+
+
+##############################################
+# Facility Tier Choice Policies for Planning #
+##############################################
+
+# A policy picks which of the facilities that can craft the given recipe the
+# planner may build, and it's free to mix any of those tiers for one recipe
+TierPolicy = Callable[[Recipe, Collection[Facility]], Collection[Facility]]
+
+
+# Every tier is fair game, e.g., two Mk.III assemblers plus one Mk.II
+def all_facility_tiers(
+    recipe: Recipe,
+    facilities: Collection[Facility]
+) -> Collection[Facility]:
+    return facilities
+
+
+# Fastest tiers first, break ties by name
+def _choose_tiers(
+    db: DataBase,
+    recipe: Recipe,
+    policy: TierPolicy
+) -> list[Facility]:
+    facilities = db.find_facilities(recipe)
+    tiers = set(policy(recipe, facilities))
+    if len(tiers) == 0:
+        raise ValueError(f"tier policy chose no facility for {recipe.name!r}")
+    for facility in tiers:
+        if facility not in facilities:
+            raise ValueError(
+                f"tier policy chose unusable facility {facility.name!r} "
+                f"for {recipe.name!r}"
+            )
+    return sorted(tiers, key=lambda f: (-f.speed, f.name))
+
+
+##################################
+# Integer Program Implementation #
+##################################
+
+# There's one integer unknown per recipe and facility tier: how many of that
+# facility get built to run that recipe. Every craftable product's net rate
+# must be at least zero, or at least the goal rate for the goal product, and
+# the total cost of all the facilities (see Objective in optimizers.py) must
+# be as small as it can get.
+class _IntegerProgram:
+
+    def __init__(
+        self,
+        db: DataBase,
+        goal: ProductQuantity[Rate],
+        objective: Objective,
+        tier_policy: TierPolicy
+    ) -> None:
+        recipes, products = candidate_recipes(db, goal.product)
+        row_of = {product: i for i, product in enumerate(products)}
+
+        self.demands = [Fraction(0)] * len(products)
+        self.demands[row_of[goal.product]] = goal.quantity.per_second
+
+        self.variables: list[tuple[Recipe, Facility]] = []
+        self.costs: list[Fraction] = []
+        self.columns: list[dict[int, Fraction]] = []  # Rates per facility
+        for recipe in recipes:
+            unit_rates = db.unit_rates(recipe)
+            for facility in _choose_tiers(db, recipe, tier_policy):
+                self.variables.append((recipe, facility))
+                self.costs.append(
+                    objective.facility_weight
+                    + objective.raw_weight * raw_use(db, recipe)
+                    * facility.speed
+                )
+                self.columns.append({
+                    row_of[product]: rate.per_second * facility.speed
+                    for product, rate in unit_rates.items()
+                    if product in row_of
+                })
+
+        # Variables making each product, cheapest per unit of it first
+        self.producers: list[list[int]] = [[] for _ in products]
+        for j, column in enumerate(self.columns):
+            for i, rate in column.items():
+                if rate > 0:
+                    self.producers[i].append(j)
+        for i, producers in enumerate(self.producers):
+            producers.sort(key=lambda j: self.costs[j] / self.columns[j][i])
+
+        # With whole costs, any whole plan has a whole cost, so relaxation
+        # bounds can be rounded up before they're compared with a plan's cost
+        self.integral_costs = all(c.denominator == 1 for c in self.costs)
+
+    def cost(self, counts: list[int]) -> Fraction:
+        return sum(
+            (c * n for c, n in zip(self.costs, counts)), Fraction(0)
+        )
+
+    # Net rates of every product for the given counts
+    def totals(self, counts: list[int]) -> list[Fraction]:
+        totals = [Fraction(0)] * len(self.demands)
+        for column, n in zip(self.columns, counts):
+            if n == 0:
+                continue
+            for i, rate in column.items():
+                totals[i] += rate * n
+        return totals
+
+    def is_feasible(self, counts: list[int]) -> bool:
+        totals = self.totals(counts)
+        return all(t >= d for t, d in zip(totals, self.demands))
+
+    # Rounds all of the relaxed counts up, which can still leave products
+    # short when their consumers got rounded up more than their producers, so
+    # those get patched by adding producers one at a time, preferring ones
+    # that are already built, and then cheapest per unit (this gives None if
+    # that takes too many tries). Then all the overbuilding gets trimmed, one
+    # facility at a time, priciest first, for as long as the plan still works.
+    # Taking a facility away only lowers the rates of its outputs, so only
+    # those need to be checked again.
+    def round_up(self, values: list[Fraction]) -> list[int] | None:
+        counts = [ceil(value) for value in values]
+        totals = self.totals(counts)
+
+        for _ in range(ROUNDING_REPAIR_LIMIT):
+            short = next(
+                (i for i, d in enumerate(self.demands) if totals[i] < d), None
+            )
+            if short is None:
+                break
+            if len(self.producers[short]) == 0:
+                return None
+            j = min(self.producers[short], key=lambda j: counts[j] == 0)
+            counts[j] += 1
+            for i, rate in self.columns[j].items():
+                totals[i] += rate
+        else:
+            return None
+
+        order = sorted(
+            (j for j, n in enumerate(counts) if n > 0),
+            key=lambda j: -self.costs[j]
+        )
+        for j in order:
+            outputs = [
+                (i, rate) for i, rate in self.columns[j].items() if rate > 0
+            ]
+            while counts[j] > 0 and all(
+                totals[i] - rate >= self.demands[i] for i, rate in outputs
+            ):
+                counts[j] -= 1
+                for i, rate in self.columns[j].items():
+                    totals[i] -= rate
+        return counts
+
+    # The LP relaxation with counts bounded to lower[j] <= counts[j] and to
+    # counts[j] <= upper[j], or None if no counts fit those bounds at all
+    # Like optimize_recipe_multipliers() in optimizers.py, this solves the
+    # dual, so each count bound becomes a new price column instead of a row,
+    # and the counts come right back out as the shadow prices of the rows
+    def relax(
+        self,
+        lower: dict[int, int],
+        upper: dict[int, int]
+    ) -> tuple[Fraction, list[Fraction]] | None:
+        prices = [-demand for demand in self.demands]
+        bound_columns: dict[int, dict[int, int]] = {}
+        for j, bound in lower.items():
+            bound_columns.setdefault(j, {})[len(prices)] = 1
+            prices.append(Fraction(-bound))
+        for j, bound in upper.items():
+            bound_columns.setdefault(j, {})[len(prices)] = -1
+            prices.append(Fraction(bound))
+
+        constraints = [
+            LinearConstraint(
+                {**column, **bound_columns.get(j, {})},
+                ConstraintSense.AT_MOST,
+                cost
+            )
+            for j, (column, cost) in enumerate(zip(self.columns, self.costs))
+        ]
+
+        # An unbounded dual means the counts can't fit all of their bounds
+        try:
+            solution = minimize_linear_program(prices, constraints)
+        except ValueError:
+            return None
+        assert solution is not None
+
+        return -solution.value, [-dual for dual in solution.duals]
+
+
+# Best-first branch-and-bound over the counts, returning the best counts
+# found (or None), whether they're proven optimal, and the cost of the root
+# relaxation. Every node's relaxed counts get rounded up into a plan (see
+# round_up() above), and then the node splits on the count that's furthest
+# from whole. Nodes wait in a heap by their parent's bound, so once the next
+# one can't beat the best plan so far, none of the others can either. Until
+# there's any plan at all though, the search dives straight down the
+# rounded-up side, since those nodes are the likeliest to round into a plan.
+def _branch_and_bound(
+    program: _IntegerProgram
+) -> tuple[list[int] | None, bool, Fraction]:
+    best: list[int] | None = None
+    best_cost = Fraction(0)
+    root_cost: Fraction | None = None
+
+    # The counter breaks ties, so the count bound dicts never get compared
+    heap: list[tuple[Fraction, int, dict[int, int], dict[int, int]]] = [
+        (Fraction(0), 0, {}, {})
+    ]
+    dive: tuple[Fraction, int, dict[int, int], dict[int, int]] | None = None
+    nodes = 0
+    while dive is not None or len(heap) > 0:
+        if dive is not None:
+            parent_bound, _, lower, upper = dive
+            dive = None
+        else:
+            parent_bound, _, lower, upper = heappop(heap)
+        if best is not None and parent_bound >= best_cost:
+            break
+        if nodes == BRANCH_AND_BOUND_NODE_LIMIT:
+            assert root_cost is not None
+            return best, False, root_cost
+        nodes += 1
+
+        relaxation = program.relax(lower, upper)
+        if relaxation is None:
+            continue
+        bound, values = relaxation
+        if root_cost is None:
+            root_cost = bound
+        if program.integral_costs:
+            bound = Fraction(ceil(bound))
+        if best is not None and bound >= best_cost:
+            continue
+
+        counts = program.round_up(values)
+        if counts is not None:
+            cost = program.cost(counts)
+            if best is None or cost < best_cost:
+                best, best_cost = counts, cost
+                if bound >= best_cost:
+                    continue
+
+        fractional = [
+            j for j, value in enumerate(values) if value.denominator != 1
+        ]
+        if len(fractional) == 0:
+            continue  # Then round_up() found this plan, or a cheaper one
+        j = max(
+            fractional,
+            key=lambda j: min(values[j] - floor(values[j]),
+                              ceil(values[j]) - values[j])
+        )
+        up = ({**lower, j: ceil(values[j])}, upper)
+        down = (lower, {**upper, j: floor(values[j])})
+        if best is None:
+            dive = (bound, 2 * nodes, *up)
+        else:
+            heappush(heap, (bound, 2 * nodes, *up))
+        heappush(heap, (bound, 2 * nodes + 1, *down))
+
+    if root_cost is None:
+        root_cost = Fraction(0)
+    return best, True, root_cost
+
+
+###############################
+# Integer Plan Implementation #
+###############################
+
+# A factory with whole numbers of facilities, what it costs, and what it would
+# cost in theory land, where the LP relaxation can build fractional facilities
+@dataclass(frozen=True, slots=True)
+class IntegerPlan:
+    factory: Factory
+    cost: Fraction
+    relaxed_cost: Fraction
+    optimal: bool
+
+    @property
+    def facility_count(self) -> int:
+        return sum(int(crafter.how_many) for crafter in self.factory.crafters)
+
+    # Everything made beyond what the factory needs, goal product included
+    def surplus_rates(self) -> dict[Product, Rate]:
+        return {
+            product: rate for product, rate in self.factory.rates.items()
+            if rate > Rate.zero()
+        }
+
+    def __str__(self) -> str:
+        INDENT: str = " " * 2
+        parts: list[str] = []
+
+        status = "optimal" if self.optimal else "best found"
+        parts.append(f"Integer Plan ({status}):")
+        parts.append(f"\n{INDENT}Goal: {self.factory.goal}")
+        parts.append(
+            f"\n{INDENT}Cost: {pretty_string(self.cost)} "
+            f"(in theory {pretty_string(self.relaxed_cost)})"
+        )
+
+        parts.append(f"\n{INDENT}Facilities ({self.facility_count}):")
+        for crafter in self.factory.crafters:
+            parts.append(f"\n{INDENT * 2}{crafter}")
+
+        surplus = self.surplus_rates()
+        parts.append(f"\n{INDENT}Surplus ({len(surplus)}):")
+        for product, product_rate in surplus.items():
+            parts.append(
+                f"\n{INDENT * 2}{ProductQuantity(product_rate, product)}"
+            )
+        if len(surplus) == 0:
+            parts.append(f"\n{INDENT * 2}(none)")
+
+        return "".join(parts)
+
+
+# Like optimize_factory() in optimizers.py, but for the DSP world instead of
+# theory land: every crafter's how_many comes out as a whole number, and the
+# mix of recipes and facility tiers is chosen to overbuild as little as it can
+def plan_integer_factory(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    objective: Objective = MINIMIZE_FACILITIES,
+    tier_policy: TierPolicy = all_facility_tiers,
+    mode: NumericMode = NumericMode.EXACT
+) -> IntegerPlan:
+    goal = intern_goal(db, goal)
+    program = _IntegerProgram(db, goal, objective, tier_policy)
+
+    counts, optimal, relaxed_cost = _branch_and_bound(program)
+    if counts is None:
+        if optimal:
+            raise ValueError(
+                f"no mix of recipes can make {goal.product.name!r} "
+                f"from raw materials"
+            )
+        raise ValueError(
+            f"no whole plan for {goal.product.name!r} found within "
+            f"{BRANCH_AND_BOUND_NODE_LIMIT} branch-and-bound nodes"
+        )
+
+    factory = Factory(goal, db, mode).connect_crafters(
+        RecipeCrafter(recipe, facility, count, db.unit_rates(recipe))
+        for (recipe, facility), count in zip(program.variables, counts)
+        if count != 0
+    )
+    ignore_raw_materials(db, factory)
+
+    return IntegerPlan(factory, program.cost(counts), relaxed_cost, optimal)
@@ -0,0 +1,293 @@
+# layered_databases.py
+# DataBase type for stacking mod data layers on top of a shared base DataBase
+
+from collections.abc import (
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    MutableSet,
+    Set as AbstractSet,
+)
+from itertools import chain
+from typing import TypeVar
+
+from databases import DataBase
+from facilities import Facility, FacilityCategory
+from products import Product
+from rates import Rate, Time
+from recipes import Recipe
+
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+#####################################
+# Layer Views over Base Collections #
+#####################################
+
+# These views answer lookups from the layer's own entries first, and then fall
+# through to the base collection unless the layer removed that entry
+# The base collection is never written to, so any number of layers can share
+# it, but that also means it must not be modified while layers are using it
+
+class _LayerDict(MutableMapping[K, V]):
+
+    def __init__(self, base: Mapping[K, V]) -> None:
+        self.base = base
+        self.local: dict[K, V] = {}
+        self.removed: set[K] = set()  # Base keys hidden by this layer
+
+    def __getitem__(self, key: K) -> V:
+        if key in self.local:
+            return self.local[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self.base[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.local:
+            return True
+        return key not in self.removed and key in self.base
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self.local[key] = value
+
+    def __delitem__(self, key: K) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.local.pop(key, None)
+        if key in self.base:
+            self.removed.add(key)
+
+    def __iter__(self) -> Iterator[K]:
+        yield from self.local
+        for key in self.base:
+            if key not in self.local and key not in self.removed:
+                yield key
+
+    def __len__(self) -> int:
+        hidden = len(self.removed) + sum(
+            1 for key in self.local
+            if key in self.base and key not in self.removed
+        )
+        return len(self.local) + len(self.base) - hidden
+
+    # Base keys whose values this layer has replaced or removed
+    def shadowed(self) -> set[K]:
+        return self.removed | set(k for k in self.local if k in self.base)
+
+
+class _LayerSet(MutableSet[K]):
+
+    def __init__(self, base: AbstractSet[K]) -> None:
+        self.base = base
+        self.local: set[K] = set()
+        self.removed: set[K] = set()  # Base elements hidden by this layer
+
+    def __contains__(self, element: object) -> bool:
+        if element in self.local:
+            return True
+        return element not in self.removed and element in self.base
+
+    def add(self, element: K) -> None:
+        if element in self.base:
+            self.removed.discard(element)
+        else:
+            self.local.add(element)
+
+    def discard(self, element: K) -> None:
+        self.local.discard(element)
+        if element in self.base:
+            self.removed.add(element)
+
+    def __iter__(self) -> Iterator[K]:
+        yield from self.local
+        for element in self.base:
+            if element not in self.removed:
+                yield element
+
+    def __len__(self) -> int:
+        return len(self.local) + len(self.base) - len(self.removed)
+
+
+##############################################
+# LayeredDataBase Type and Inner Constructor #
+##############################################
+
+# Every collection of the base DataBase is wrapped in a layer view, so nothing
+# from the base is copied, and the lookup tables only hold new entries for
+# the products and facility categories that the layer actually affects
+# Layers can be stacked by passing one LayeredDataBase as the base of another
+# To override something from a lower layer, remove it and then add it again
+class LayeredDataBase(DataBase):
+
+    def __init__(self, base: DataBase) -> None:
+        super().__init__()
+        self.base = base
+
+        self.facility_categories: _LayerSet[FacilityCategory] = (
+            _LayerSet(base.facility_categories)
+        )
+        self.facilities: _LayerDict[str, Facility] = (
+            _LayerDict(base.facilities)
+        )
+        self.products: _LayerSet[Product] = _LayerSet(base.products)
+        self.recipes: _LayerDict[str, Recipe] = _LayerDict(base.recipes)
+        self.rates: _LayerDict[str, Rate] = _LayerDict(base.rates)
+        self.times: _LayerDict[str, Time] = _LayerDict(base.times)
+        self.lookup_table_facilities: _LayerDict[
+            FacilityCategory, set[Facility]
+        ] = _LayerDict(base.lookup_table_facilities)
+        self.lookup_table_recipes: _LayerDict[Product, set[Recipe]] = (
+            _LayerDict(base.lookup_table_recipes)
+        )
+        self.lookup_table_consumers: _LayerDict[
+            Product, frozenset[Recipe]
+        ] = _LayerDict(base.lookup_table_consumers)
+        self.lookup_table_made_in: _LayerDict[
+            FacilityCategory, frozenset[Recipe]
+        ] = _LayerDict(base.lookup_table_made_in)
+        self.interned_products: _LayerDict[str, Product] = (
+            _LayerDict(base.interned_products)
+        )
+        self.interned_categories: _LayerDict[str, FacilityCategory] = (
+            _LayerDict(base.interned_categories)
+        )
+
+    ###############################
+    # Lookup Table Initialization #
+    ###############################
+
+    # Only the table entries touched by this layer are rebuilt, from the base
+    # entry minus anything shadowed plus anything added by the layer
+
+    def _make_table_facilities(self) -> 'LayeredDataBase':
+        table = self.lookup_table_facilities
+        table.local.clear()
+        table.removed.clear()
+
+        shadowed = self.facilities.shadowed()
+        touched = set(
+            facility.category for facility in chain(
+                (self.base.facilities[name] for name in shadowed),
+                self.facilities.local.values(),
+            )
+        )
+
+        for category in touched:
+            facilities = set(
+                facility
+                for facility in self.base.lookup_table_facilities.get(
+                    category, set()
+                )
+                if facility.name not in shadowed
+            )
+            facilities.update(
+                facility for facility in self.facilities.local.values()
+                if facility.category == category
+            )
+
+            if len(facilities) > 0:
+                table[category] = facilities
+            elif category in table:
+                del table[category]
+        return self
+
+    # Rebuilds the touched entries of a table that indexes recipes by the
+    # keys returned from recipe_keys, leaving the caller to store them
+    def _remake_recipe_table(
+        self,
+        table: _LayerDict[K, V],
+        base_table: Mapping[K, AbstractSet[Recipe]],
+        recipe_keys: Callable[[Recipe], Iterable[K]]
+    ) -> dict[K, set[Recipe]]:
+        table.local.clear()
+        table.removed.clear()
+
+        shadowed = self.recipes.shadowed()
+        local_entries: dict[K, set[Recipe]] = {}
+        for recipe in self.recipes.local.values():
+            for key in recipe_keys(recipe):
+                if key not in local_entries:
+                    local_entries[key] = set()
+                local_entries[key].add(recipe)
+
+        touched = set(local_entries)
+        for name in shadowed:
+            touched.update(recipe_keys(self.base.recipes[name]))
+
+        entries: dict[K, set[Recipe]] = {}
+        for key in touched:
+            recipes = set(
+                recipe for recipe in base_table.get(key, set())
+                if recipe.name not in shadowed
+            )
+            recipes |= local_entries.get(key, set())
+            entries[key] = recipes
+        return entries
+
+    def _make_table_recipes(self) -> 'LayeredDataBase':
+        table = self.lookup_table_recipes
+        entries = self._remake_recipe_table(
+            table, self.base.lookup_table_recipes,
+            lambda recipe: (q.product for q in recipe.outputs),
+        )
+        for product, recipes in entries.items():
+            if len(recipes) > 0:
+                table[product] = recipes
+            elif product in table:
+                del table[product]
+        return self
+
+    def _make_table_consumers(self) -> 'LayeredDataBase':
+        table = self.lookup_table_consumers
+        entries = self._remake_recipe_table(
+            table, self.base.lookup_table_consumers,
+            lambda recipe: (q.product for q in recipe.inputs),
+        )
+        for product, recipes in entries.items():
+            if len(recipes) > 0:
+                table[product] = frozenset(recipes)
+            elif product in table:
+                del table[product]
+        return self
+
+    def _make_table_made_in(self) -> 'LayeredDataBase':
+        table = self.lookup_table_made_in
+        entries = self._remake_recipe_table(
+            table, self.base.lookup_table_made_in,
+            lambda recipe: (recipe.made_in,),
+        )
+        for category, recipes in entries.items():
+            if len(recipes) > 0:
+                table[category] = frozenset(recipes)
+            elif category in table:
+                del table[category]
+        return self
+
+    #####################################
+    # Incremental DataBase Modification #
+    #####################################
+
+    # Table entries falling through to the base are shared with it, so copy
+    # them into this layer before DataBase modifies them in place
+    # The frozen tables never get modified in place, so they don't need this
+
+    def _copy_table_entries(self, recipe: Recipe) -> None:
+        table = self.lookup_table_recipes
+        for quantity in recipe.outputs:
+            product = quantity.product
+            if product in table and product not in table.local:
+                table[product] = set(table[product])
+
+    def add_recipe(self, recipe: Recipe) -> 'LayeredDataBase':
+        self._copy_table_entries(recipe)
+        super().add_recipe(recipe)
+        return self
+
+    def remove_recipe(self, recipe_name: str) -> Recipe:
+        if recipe_name in self.recipes:
+            self._copy_table_entries(self.recipes[recipe_name])
+        return super().remove_recipe(recipe_name)
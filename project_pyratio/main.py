@@ -9,6 +9,8 @@
 
 # General utilities
 from rational_utilities import *
+from rational_linear_algebra import *
+from rational_linear_programming import *
 from user_questions import *
 
 # Types for representing DSP game concepts
@@ -20,13 +22,22 @@ from proliferators import *
 
 # DataBase code for loading data and making queries
 from databases import *
+from layered_databases import *
+from compiled_databases import *
+from recipe_graphs import *
+from raw_costs import *
 from abbreviations import *
 from recipe_readers import *
+from recipe_writers import *
 from data_loaders import *
 
 # Factories and algorithms for manipulating them based on user input
+from rate_vectors import *
 from factories import *
 from algorithms import *
+from solvers import *
+from optimizers import *
+from integer_planners import *
 
 
 ##################################
@@ -36,9 +47,12 @@ from algorithms import *
 def create_database() -> DataBase:
     db = DataBase()
 
+    # The snapshot already includes the lookup tables, so skip everything
     print()
-    load_database(db)
-    db.make_tables()
+    if not load_database_snapshot(db):
+        load_database(db)
+        db.make_tables()
+        save_database_snapshot(db)
 
     return db
 
@@ -0,0 +1,169 @@
+# optimizers.py
+# Automatic mixing of alternate recipes, by exact linear programming
+
+from dataclasses import dataclass
+from fractions import Fraction
+
+from databases import DataBase
+from factories import Factory
+from products import Product, ProductQuantity
+from rate_vectors import NumericMode
+from rates import Rate
+from rational_linear_programming import (
+    ConstraintSense, LinearConstraint, minimize_linear_program
+)
+from raw_costs import net_output
+from recipes import Recipe
+from solvers import (
+    FacilityPolicy, build_factory, choose_facility, default_facility_policy,
+    intern_goal
+)
+
+
+###############################
+# Optimization Objective Type #
+###############################
+
+# What a factory costs: the weighted sum of its facility count and of its raw
+# material use per second, so setting both weights makes a blend of the two
+@dataclass(init=False, frozen=True, slots=True)
+class Objective:
+    facility_weight: Fraction
+    raw_weight: Fraction
+
+    def __init__(
+        self,
+        facility_weight: Fraction | int,
+        raw_weight: Fraction | int
+    ) -> None:
+        if facility_weight < 0 or raw_weight < 0:
+            raise ValueError("objective weights must not be negative")
+        if facility_weight == 0 and raw_weight == 0:
+            raise ValueError("objective must have some positive weight")
+        object.__setattr__(self, "facility_weight", Fraction(facility_weight))
+        object.__setattr__(self, "raw_weight", Fraction(raw_weight))
+
+
+MINIMIZE_FACILITIES: Objective = Objective(1, 0)
+MINIMIZE_RAW_MATERIALS: Objective = Objective(0, 1)
+
+
+#########################################
+# Recipe Program Setup and Optimization #
+#########################################
+
+# Every recipe with a positive net output of the goal, or of any craftable
+# product that such a recipe has a net input of, and so on down, along with
+# all of those products (the goal comes first)
+def candidate_recipes(
+    db: DataBase,
+    goal: Product
+) -> tuple[list[Recipe], list[Product]]:
+    if len(db.find_recipes(goal)) == 0:
+        raise ValueError(f"goal product {goal.name!r} is a raw material")
+
+    recipes: dict[Recipe, None] = {}
+    reached: set[Product] = {goal}
+    queue: list[Product] = [goal]
+
+    for product in queue:  # The queue grows as this loop goes
+        for recipe in sorted(db.find_recipes(product), key=lambda r: r.name):
+            if recipe in recipes or net_output(recipe, product) <= 0:
+                continue
+            if len(db.find_facilities(recipe)) == 0:
+                continue
+            recipes[recipe] = None
+
+            for input_product, rate in db.unit_rates(recipe).items():
+                if rate >= Rate.zero() or input_product in reached:
+                    continue
+                reached.add(input_product)
+                if len(db.find_recipes(input_product)) > 0:
+                    queue.append(input_product)
+
+    return list(recipes), queue
+
+
+# Raw materials used per second by one facility at speed 1
+def raw_use(db: DataBase, recipe: Recipe) -> Fraction:
+    return sum(
+        (
+            -rate.per_second for product, rate in db.unit_rates(recipe).items()
+            if rate < Rate.zero() and len(db.find_recipes(product)) == 0
+        ),
+        Fraction(0)
+    )
+
+
+# The problem is to find recipe multipliers m (facilities at speed 1) with
+# minimal cost c * m, where every craftable product's net rate A * m is at
+# least zero, or at least the goal rate for the goal (so over zero means a
+# byproduct). Nearly all of those bounds are zero, which makes the simplex
+# crawl through endless degenerate pivots, so instead this solves the dual:
+# find product prices y >= 0 that make the goal worth the most, while no
+# recipe's outputs are worth more than its inputs plus its own cost. Zero
+# prices always work for that, so no phase 1 is needed either, and the
+# multipliers come right back out as the shadow prices of the recipe rows.
+# The simplex is exact, so the multipliers come out as exact Fractions.
+def optimize_recipe_multipliers(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    objective: Objective = MINIMIZE_FACILITIES,
+    facility_policy: FacilityPolicy = default_facility_policy
+) -> dict[Recipe, Fraction]:
+    goal = intern_goal(db, goal)
+    recipes, products = candidate_recipes(db, goal.product)
+    column_of = {product: i for i, product in enumerate(products)}
+
+    constraints: list[LinearConstraint] = []
+    for recipe in recipes:
+        facility = choose_facility(db, recipe, facility_policy)
+        cost = (
+            objective.facility_weight / facility.speed
+            + objective.raw_weight * raw_use(db, recipe)
+        )
+        row = {
+            column_of[product]: rate.per_second
+            for product, rate in db.unit_rates(recipe).items()
+            if product in column_of
+        }
+        constraints.append(
+            LinearConstraint(row, ConstraintSense.AT_MOST, cost)
+        )
+
+    # The goal price times the goal rate is all that the dual maximizes
+    prices = [Fraction(0)] * len(products)
+    prices[column_of[goal.product]] = -goal.quantity.per_second
+
+    # An unbounded dual means the goal price can go up forever, since there's
+    # no way to make the goal at all
+    try:
+        solution = minimize_linear_program(prices, constraints)
+    except ValueError:
+        raise ValueError(
+            f"no mix of recipes can make {goal.product.name!r} "
+            f"from raw materials"
+        ) from None
+    assert solution is not None
+
+    return {
+        recipe: -dual
+        for recipe, dual in zip(recipes, solution.duals)
+        if dual != 0
+    }
+
+
+# Like solve_factory() in solvers.py, but instead of following one recipe
+# choice per product, this finds the cheapest mix of every recipe there is
+def optimize_factory(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    objective: Objective = MINIMIZE_FACILITIES,
+    facility_policy: FacilityPolicy = default_facility_policy,
+    mode: NumericMode = NumericMode.EXACT
+) -> Factory:
+    goal = intern_goal(db, goal)
+    multipliers = optimize_recipe_multipliers(
+        db, goal, objective, facility_policy
+    )
+    return build_factory(db, goal, multipliers, facility_policy, mode)
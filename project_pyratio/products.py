@@ -1,7 +1,7 @@
 # products.py
 # Foundational types for representing DSP recipe ingredients
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Generic, TypeVar
 
 
@@ -9,14 +9,34 @@ from typing import Generic, TypeVar
 # Product Type Implementation #
 ###############################
 
+# Products get compared and hashed constantly as dict keys, so the hash is
+# computed once up front, and equality checks identity before names
+# A DataBase interns its products, so most comparisons stop at identity
 @dataclass(init=False, frozen=True, slots=True)
 class Product:
     name: str
+    _hash: int = field(repr=False, compare=False)
 
     def __init__(self, name: str) -> None:
         object.__setattr__(self, "name", name.strip())
         if self.name == "":
             raise ValueError("product name empty or all whitespace")
+        object.__setattr__(self, "_hash", hash(self.name))
+
+    def __eq__(self, other: object) -> bool:
+        if self is other:
+            return True
+        if other.__class__ is not Product:
+            return NotImplemented
+        assert isinstance(other, Product)
+        return self._hash == other._hash and self.name == other.name
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    # String hashes change between runs, so never pickle the cached hash
+    def __reduce__(self) -> tuple[type['Product'], tuple[str]]:
+        return (Product, (self.name,))
 
     def __str__(self) -> str:
         return self.name
@@ -0,0 +1,247 @@
+# rate_vectors.py
+# Whole-array product rate math, over the dense product IDs of a DataBase
+
+from collections.abc import Sequence
+from enum import Enum
+from math import lcm
+from typing import Any
+
+from rates import Rate, RateScale
+
+# NumPy is optional, without it the vectors are just lists of Python ints
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Largest magnitude that an int64 entry can safely hold
+INT64_LIMIT: int = 2 ** 63 - 1
+
+# Float64 holds every integer up to this magnitude exactly
+FLOAT64_INT_LIMIT: int = 2 ** 52
+
+
+######################################
+# Numeric Modes for Rate Calculation #
+######################################
+
+# FLOAT mode does the sums in float64 first, and only keeps the answer if it
+# can be proven to round to the exact one, otherwise it quietly does the exact
+# calculation instead, so both modes always give identical results
+# Only full recomputations of a Factory use it, since an incremental update
+# for one crafter is just a handful of integer terms (see factories.py)
+class NumericMode(Enum):
+    EXACT = "exact"
+    FLOAT = "float"
+
+
+##################################
+# RateVector Type Implementation #
+##################################
+
+# Entry i is the net rate of the product with ID i (see compiled_databases.py)
+# in integer units of the vector's RateScale. With NumPy, entries live in an
+# int64 array, until some operation could overflow it, and then the vector
+# switches over to an object array of Python ints, which is slower but exact.
+# Every operation keeps track of a bound on the entry sizes to decide that.
+class RateVector:
+
+    def __init__(self, scale: RateScale, values: Any, bound: int) -> None:
+        self.scale = scale
+        self.values = values
+        self.bound = bound  # No entry is larger than this in magnitude
+
+    @classmethod
+    def zeros(cls, size: int, scale: RateScale) -> 'RateVector':
+        if np is None:
+            return RateVector(scale, [0] * size, 0)
+        return RateVector(scale, np.zeros(size, dtype=np.int64), 0)
+
+    # Adds up all of the given units, where ids may repeat
+    @classmethod
+    def from_units(
+        cls,
+        size: int,
+        scale: RateScale,
+        ids: Sequence[int],
+        units: Sequence[int]
+    ) -> 'RateVector':
+        return RateVector.zeros(size, scale).add_units(ids, units)
+
+    # Float version of from_units(), where the terms are rates per second
+    # and each term's exact value has the matching entry of denominators as
+    # its denominator. Each product's true sum is then a whole number of
+    # 1/d units, with d the lcm of just its own terms' denominators, so the
+    # float sums get rounded at that scale and not at the (often far finer)
+    # vector scale, which only has to be a multiple of every d. Rounding is
+    # only certainly exact if the float error is under half of a 1/d unit:
+    # every term carries at most a few roundings, and each of the count
+    # additions into a sum adds at most one more, so the error stays under
+    # (count + 8) * 2^-53 * (sum of |terms|), with room to spare.
+    # Returns None when that bound is too big to be sure, or without NumPy.
+    @classmethod
+    def from_float_terms(
+        cls,
+        size: int,
+        scale: RateScale,
+        ids: Sequence[int],
+        terms: Sequence[float],
+        denominators: Sequence[int]
+    ) -> 'RateVector | None':
+        if np is None:
+            return None
+
+        # Crafters of the same kind repeat their (id, denominator) pairs a
+        # lot, so the Python lcm only has to run over the distinct ones
+        product_denominators = [1] * size
+        for product_id, denominator in set(zip(ids, denominators)):
+            product_denominators[product_id] = lcm(
+                product_denominators[product_id], denominator
+            )
+        if max(product_denominators, default=1) >= FLOAT64_INT_LIMIT:
+            return None
+
+        id_array = np.array(ids, dtype=np.int64)
+        term_array = np.array(terms, dtype=np.float64)
+        sums = np.zeros(size, dtype=np.float64)
+        np.add.at(sums, id_array, term_array)
+        magnitudes = np.zeros(size, dtype=np.float64)
+        np.add.at(magnitudes, id_array, np.abs(term_array))
+        counts = np.bincount(id_array, minlength=size)
+
+        # The 2^-50 here, instead of 2^-53, covers the scaling by denominator
+        # and leaves a safety factor for the float math of the bound itself
+        denominator_array = np.array(product_denominators, dtype=np.float64)
+        scaled = sums * denominator_array
+        error_bounds = (
+            magnitudes * denominator_array * (counts + 8) * 2.0 ** -50
+        )
+        if not np.all(np.isfinite(error_bounds)):
+            return None
+        if error_bounds.max(initial=0.0) >= 0.25:
+            return None
+        if np.abs(scaled).max(initial=0.0) >= FLOAT64_INT_LIMIT:
+            return None
+        numerators = np.rint(scaled).astype(np.int64)
+
+        # Moving over to the vector scale is one exact multiply per product
+        for denominator in product_denominators:
+            if scale.denominator % denominator != 0:
+                raise ValueError(
+                    f"rate denominator {denominator} does not fit rate scale "
+                    f"1/{scale.denominator}"
+                )
+        factors = [scale.denominator // d for d in product_denominators]
+        numerator_bound = max(int(np.abs(numerators).max(initial=0)), 1)
+        if numerator_bound * max(factors, default=1) > INT64_LIMIT:
+            values = numerators.astype(object) * np.array(
+                factors, dtype=object
+            )
+        else:
+            values = numerators * np.array(factors, dtype=np.int64)
+        return RateVector(scale, values, int(np.abs(values).max(initial=0)))
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    # The only in-place update, for applying small changes to a big vector
+    def add_units(
+        self,
+        ids: Sequence[int],
+        units: Sequence[int]
+    ) -> 'RateVector':
+        added = sum(abs(u) for u in units)
+        bound = self.bound + added
+        if np is None:
+            for i, u in zip(ids, units):
+                self.values[i] += u
+        else:
+            # Adding and taking away the same crafters only ever grows the
+            # bound, so check the real entries before giving up on int64
+            if bound > INT64_LIMIT and self.values.dtype != object:
+                bound = int(np.abs(self.values).max(initial=0)) + added
+            if bound > INT64_LIMIT:
+                self.values = self._object_values()
+            np.add.at(
+                self.values,
+                np.array(ids, dtype=np.int64),
+                np.array(units, dtype=self.values.dtype),
+            )
+        self.bound = bound
+        return self
+
+    def _object_values(self) -> Any:
+        if np is None or self.values.dtype == object:
+            return self.values
+        return self.values.astype(object)
+
+    ###################################
+    # RateVector Arithmetic Functions #
+    ###################################
+
+    def _combine(self, other: 'RateVector', sign: int) -> 'RateVector':
+        if self.scale != other.scale:
+            raise ValueError("cannot combine rate vectors of different scales")
+        if len(self) != len(other):
+            raise ValueError("cannot combine rate vectors of different sizes")
+
+        bound = self.bound + other.bound
+        if np is None:
+            values = [a + sign * b for a, b in zip(self.values, other.values)]
+        elif bound > INT64_LIMIT:
+            values = (
+                self._object_values() + sign * other._object_values()
+            )
+        else:
+            values = self.values + sign * other.values
+        return RateVector(self.scale, values, bound)
+
+    def __add__(self, other: 'RateVector') -> 'RateVector':
+        return self._combine(other, 1)
+
+    def __sub__(self, other: 'RateVector') -> 'RateVector':
+        return self._combine(other, -1)
+
+    def __neg__(self) -> 'RateVector':
+        if np is None:
+            values = [-a for a in self.values]
+            return RateVector(self.scale, values, self.bound)
+        return RateVector(self.scale, -self.values, self.bound)
+
+    def scaled(self, factor: int) -> 'RateVector':
+        bound = self.bound * abs(factor)
+        if np is None:
+            values = [a * factor for a in self.values]
+        elif bound > INT64_LIMIT or abs(factor) > INT64_LIMIT:
+            values = self._object_values() * factor
+        else:
+            values = self.values * factor
+        return RateVector(self.scale, values, bound)
+
+    # Same rates, in units of a scale whose denominator is a multiple of ours
+    def rescaled(self, scale: RateScale) -> 'RateVector':
+        if scale.denominator % self.scale.denominator != 0:
+            raise ValueError("rate vectors can only move to a finer scale")
+        vector = self.scaled(scale.denominator // self.scale.denominator)
+        return RateVector(scale, vector.values, vector.bound)
+
+    ##############################
+    # RateVector Query Functions #
+    ##############################
+
+    def negative_mask(self) -> Any:
+        if np is None:
+            return [a < 0 for a in self.values]
+        return self.values < 0
+
+    def negative_ids(self) -> list[int]:
+        if np is None:
+            return [i for i, a in enumerate(self.values) if a < 0]
+        return np.flatnonzero(self.values < 0).tolist()
+
+    def units(self, product_id: int) -> int:
+        return int(self.values[product_id])
+
+    def rate(self, product_id: int) -> Rate:
+        return self.scale.rate(self.units(product_id))
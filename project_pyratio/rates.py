@@ -6,6 +6,7 @@
 
 from dataclasses import dataclass
 from fractions import Fraction
+from math import lcm
 from numbers import Number
 from typing import Union
 
@@ -124,3 +125,39 @@ class Rate(Number):
 
     def __rtruediv__(self, other: IntegerOrRational) -> 'Time':
         return Time(self / other)
+
+
+#################################
+# RateScale Type Implementation #
+#################################
+
+# Adding up Rates makes a new Fraction (plus a gcd) for every single operation
+# Instead, rates can be kept as integer "units" of 1/denominator per second,
+# so sums are plain int math, and only the final results become Rates again
+# DataBase.rate_scale() gives a denominator that fits the unit rates of every
+# recipe and facility pair, and scaled_by() extends it to fit other values
+@dataclass(init=False, frozen=True, slots=True)
+class RateScale:
+    denominator: int
+
+    def __init__(self, denominator: int) -> None:
+        if denominator <= 0:
+            raise ValueError("rate scale denominator must be positive")
+        object.__setattr__(self, "denominator", denominator)
+
+    def scaled_by(self, *multiples: int) -> 'RateScale':
+        return RateScale(self.denominator * lcm(*multiples))
+
+    def units(self, rate: Union[Rate, IntegerOrRational]) -> int:
+        if isinstance(rate, Rate):
+            rate = rate.per_second
+        scaled = Fraction(rate) * self.denominator
+        if scaled.denominator != 1:
+            raise ValueError(
+                f"rate {pretty_string(rate)}/s does not fit rate scale "
+                f"1/{self.denominator}"
+            )
+        return scaled.numerator
+
+    def rate(self, units: int) -> Rate:
+        return Rate(Fraction(units, self.denominator))
@@ -0,0 +1,85 @@
+# rational_linear_algebra.py
+# Exact linear system solving for rational matrices, with no float math at all
+
+from fractions import Fraction
+from math import lcm
+
+
+#################################
+# Fraction-Free Row Elimination #
+#################################
+
+# Rows get scaled up to integers first, since integer math is much faster than
+# Fraction math. Bareiss elimination then keeps every entry an integer: each
+# division it does is exact, and the entries only grow as large as the
+# determinants of the submatrices, instead of blowing up exponentially.
+
+def _integer_row(row: list[Fraction]) -> list[int]:
+    scale = lcm(*(Fraction(x).denominator for x in row))
+    return [int(x * scale) for x in row]
+
+
+def _bareiss_eliminate(augmented: list[list[int]], size: int) -> None:
+    previous_pivot = 1
+    for k in range(size):
+        pivot_row = next(
+            (i for i in range(k, size) if augmented[i][k] != 0), None
+        )
+        if pivot_row is None:
+            raise ValueError("linear system matrix is singular")
+        if pivot_row != k:
+            augmented[k], augmented[pivot_row] = (
+                augmented[pivot_row], augmented[k]
+            )
+
+        pivot = augmented[k][k]
+        row_k = augmented[k]
+        for i in range(k + 1, size):
+            row_i = augmented[i]
+            factor = row_i[k]
+            for j in range(k + 1, len(row_i)):
+                row_i[j] = (
+                    row_i[j] * pivot - factor * row_k[j]
+                ) // previous_pivot
+            row_i[k] = 0
+        previous_pivot = pivot
+
+
+#######################################
+# Rational Linear System Solver Entry #
+#######################################
+
+# Solves A X = B for X, where A is square and B can have any number of columns
+# Raises ValueError when A is singular, so there's no unique solution
+def solve_linear_system(
+    matrix: list[list[Fraction]],
+    right_hand_side: list[list[Fraction]]
+) -> list[list[Fraction]]:
+    size = len(matrix)
+    if len(right_hand_side) != size:
+        raise ValueError("linear system sides have different row counts")
+    if any(len(row) != size for row in matrix):
+        raise ValueError("linear system matrix is not square")
+    if size == 0:
+        return []
+    columns = len(right_hand_side[0])
+
+    augmented = [
+        _integer_row(list(row) + list(rhs_row))
+        for row, rhs_row in zip(matrix, right_hand_side)
+    ]
+    _bareiss_eliminate(augmented, size)
+
+    solution: list[list[Fraction]] = [[] for _ in range(size)]
+    for i in reversed(range(size)):
+        row = augmented[i]
+        solution[i] = [
+            Fraction(
+                row[size + c] - sum(
+                    row[j] * solution[j][c] for j in range(i + 1, size)
+                ),
+                row[i],
+            )
+            for c in range(columns)
+        ]
+    return solution
@@ -0,0 +1,439 @@
+# rational_linear_programming.py
+# Exact linear program solving for rational problems, by the simplex method
+
+from dataclasses import dataclass
+from enum import Enum
+from fractions import Fraction
+from math import gcd, lcm
+
+
+# Degenerate pivots in a row before the simplex switches to Bland's rule
+BLAND_AFTER_DEGENERATE_PIVOTS: int = 20
+
+
+########################################
+# Linear Constraint and Solution Types #
+########################################
+
+class ConstraintSense(Enum):
+    AT_LEAST = ">="
+    AT_MOST = "<="
+    EQUAL = "=="
+
+
+# Coefficients are sparse, keyed by variable index, since most variables only
+# show up in a few constraints
+@dataclass(init=False, frozen=True, slots=True)
+class LinearConstraint:
+    coefficients: dict[int, Fraction]
+    sense: ConstraintSense
+    bound: Fraction
+
+    def __init__(
+        self,
+        coefficients: dict[int, Fraction | int],
+        sense: ConstraintSense,
+        bound: Fraction | int
+    ) -> None:
+        object.__setattr__(self, "coefficients", {
+            j: Fraction(a) for j, a in coefficients.items() if a != 0
+        })
+        object.__setattr__(self, "sense", sense)
+        object.__setattr__(self, "bound", Fraction(bound))
+
+
+# The duals are the shadow prices of the constraints: how much the optimal
+# value goes up per unit that each constraint's bound goes up
+@dataclass(frozen=True, slots=True)
+class LinearSolution:
+    value: Fraction
+    values: list[Fraction]
+    duals: list[Fraction]
+
+
+#########################################
+# Sparse Simplex Tableau Implementation #
+#########################################
+
+# Key of the right-hand side in every tableau row, since columns are >= 0
+_RHS: int = -1
+
+
+# Every row is a dict from column to a nonzero coefficient, so pivots only
+# touch the entries that are really there. Recipe matrices are very sparse,
+# and they stay that way pretty well as the pivots go along.
+# Like in rational_linear_algebra.py, the math is all done with ints: each row
+# holds integer coefficients over one positive denominator of its own, which
+# is many times faster than making a new Fraction for every single entry.
+# The right-hand side lives in each row too, under the _RHS key, and so does
+# the objective row, as the reduced costs with the negated objective value.
+# The entering column is normally the one with the most negative reduced cost
+# (Dantzig's rule), which takes far fewer pivots, but it can cycle forever on
+# a degenerate vertex, where pivots don't move anywhere. So after a run of
+# those, Bland's rule takes over: always the lowest index that works, which
+# can never cycle, until a pivot finally makes some progress again.
+class _Tableau:
+
+    def __init__(self) -> None:
+        self.rows: list[dict[int, int]] = []
+        self.denominators: list[int] = []
+        self.basis: list[int] = []
+
+        # Columns from here on up are never allowed to enter the basis
+        self.column_limit: int | None = None
+
+        # The objective is value + sum(reduced[j] * x[j] for nonbasic x[j])
+        self.objective: dict[int, int] = {}
+        self.objective_denominator = 1
+
+    def add_row(
+        self,
+        row: dict[int, Fraction],
+        rhs: Fraction,
+        basic_column: int
+    ) -> None:
+        integer_row, denominator = _integer_row({**row, _RHS: rhs})
+        self.rows.append(integer_row)
+        self.denominators.append(denominator)
+        self.basis.append(basic_column)
+
+    def set_objective(self, costs: dict[int, Fraction]) -> None:
+        objective, denominator = _integer_row(costs)
+        for row, basic_column in zip(self.rows, self.basis):
+            if basic_column in objective:
+                denominator = _eliminate(
+                    objective, denominator, row, basic_column
+                )
+        self.objective = objective
+        self.objective_denominator = denominator
+
+    def rhs(self, row_index: int) -> Fraction:
+        return Fraction(
+            self.rows[row_index].get(_RHS, 0), self.denominators[row_index]
+        )
+
+    def reduced_cost(self, column: int) -> Fraction:
+        return Fraction(
+            self.objective.get(column, 0), self.objective_denominator
+        )
+
+    def value(self) -> Fraction:
+        return Fraction(
+            -self.objective.get(_RHS, 0), self.objective_denominator
+        )
+
+    def pivot(self, row_index: int, column: int) -> None:
+        pivot_row = self.rows[row_index]
+        self.denominators[row_index] = _normalize(
+            pivot_row, pivot_row[column]
+        )
+
+        for i, row in enumerate(self.rows):
+            if i != row_index and column in row:
+                self.denominators[i] = _eliminate(
+                    row, self.denominators[i], pivot_row, column
+                )
+
+        if column in self.objective:
+            self.objective_denominator = _eliminate(
+                self.objective, self.objective_denominator, pivot_row, column
+            )
+
+        self.basis[row_index] = column
+
+    # Returns False if the objective turned out to be unbounded below
+    # Denominators are positive, so signs and same-row comparisons can just
+    # use the integer coefficients as they are
+    def minimize(self) -> bool:
+        degenerate_pivots = 0
+        while True:
+            candidates = [
+                (d, j) for j, d in self.objective.items()
+                if d < 0 and j != _RHS and (
+                    self.column_limit is None or j < self.column_limit
+                )
+            ]
+            if len(candidates) == 0:
+                return True
+            if degenerate_pivots < BLAND_AFTER_DEGENERATE_PIVOTS:
+                column = min(candidates)[1]
+            else:
+                column = min(j for _, j in candidates)
+
+            best: tuple[Fraction, int, int] | None = None
+            for i, row in enumerate(self.rows):
+                a = row.get(column, 0)
+                if a > 0:
+                    candidate = (
+                        Fraction(row.get(_RHS, 0), a), self.basis[i], i
+                    )
+                    if best is None or candidate < best:
+                        best = candidate
+            if best is None:
+                return False
+            if best[0] == 0:
+                degenerate_pivots += 1
+            else:
+                degenerate_pivots = 0
+            self.pivot(best[2], column)
+
+    # The dual simplex, for after the right-hand side changes: the reduced
+    # costs all stay optimal, and pivots only fix the negative right-hand
+    # sides, using Bland's rule on both the rows and the columns
+    # Returns False if the constraints turned out to be impossible to meet
+    def restore_feasibility(self) -> bool:
+        while True:
+            infeasible = min(
+                (
+                    (self.basis[i], i) for i, row in enumerate(self.rows)
+                    if row.get(_RHS, 0) < 0
+                ),
+                default=None
+            )
+            if infeasible is None:
+                return True
+            row_index = infeasible[1]
+
+            best: tuple[Fraction, int] | None = None
+            for j, a in self.rows[row_index].items():
+                if a >= 0 or j == _RHS:
+                    continue
+                if self.column_limit is not None and j >= self.column_limit:
+                    continue
+                candidate = (Fraction(self.objective.get(j, 0), -a), j)
+                if best is None or candidate < best:
+                    best = candidate
+            if best is None:
+                return False
+            self.pivot(row_index, best[1])
+
+    # The identity columns hold the inverse of the basis, so multiplying
+    # them by the new bounds gives every row its new right-hand side, and
+    # doing the same to the objective row gives its new value
+    def set_bounds(self, identity_bounds: dict[int, Fraction]) -> None:
+        for i, row in enumerate(self.rows):
+            self.denominators[i] = _rebound(
+                row, self.denominators[i], identity_bounds
+            )
+        self.objective_denominator = _rebound(
+            self.objective, self.objective_denominator, identity_bounds
+        )
+
+    def remove_row(self, row_index: int) -> None:
+        del self.rows[row_index]
+        del self.denominators[row_index]
+        del self.basis[row_index]
+
+
+def _integer_row(row: dict[int, Fraction]) -> tuple[dict[int, int], int]:
+    denominator = lcm(*(Fraction(a).denominator for a in row.values()))
+    integer_row = {
+        j: int(a * denominator) for j, a in row.items() if a != 0
+    }
+    return integer_row, _reduce(integer_row, denominator)
+
+
+def _rebound(
+    row: dict[int, int],
+    denominator: int,
+    identity_bounds: dict[int, Fraction]
+) -> int:
+    rhs = sum(
+        (
+            a * identity_bounds[j]
+            for j, a in row.items() if j in identity_bounds
+        ),
+        Fraction(0)
+    )
+    if rhs.denominator != 1:
+        for j in row:
+            row[j] *= rhs.denominator
+        denominator *= rhs.denominator
+    row[_RHS] = rhs.numerator
+    if row[_RHS] == 0:
+        del row[_RHS]
+    return _reduce(row, denominator)
+
+
+# Small positive amounts added to the AT_MOST bounds, all over 2^26 so the
+# denominators stay small, which vary enough that ties are very unlikely
+def _perturbation(row_index: int) -> Fraction:
+    return Fraction(1 + row_index * 7919 % 997, 2 ** 26)
+
+
+# Divides out the common factor of the row and its denominator
+def _reduce(row: dict[int, int], denominator: int) -> int:
+    divisor = gcd(denominator, *row.values())
+    if divisor > 1:
+        for j, a in row.items():
+            row[j] = a // divisor
+        denominator //= divisor
+    return denominator
+
+
+# The row gets divided by value, so it has to keep a positive denominator
+def _normalize(row: dict[int, int], value: int) -> int:
+    if value < 0:
+        for j, a in row.items():
+            row[j] = -a
+        value = -value
+    return _reduce(row, value)
+
+
+# Subtracts the multiple of pivot_row that zeroes out row[column]
+# That's (row * p - a * pivot_row) / (denominator * p), where a and p are the
+# two coefficients in the column, so the pivot row's denominator cancels out
+# Any common factor of a and p comes out first, to keep the numbers small
+def _eliminate(
+    row: dict[int, int],
+    denominator: int,
+    pivot_row: dict[int, int],
+    column: int
+) -> int:
+    a = row[column]
+    p = pivot_row[column]
+    divisor = gcd(a, p)
+    a //= divisor
+    p //= divisor
+    if p != 1:
+        for j, b in row.items():
+            row[j] = b * p
+    zeroed: list[int] = []
+    get = row.get
+    for j, b in pivot_row.items():
+        updated = get(j, 0) - a * b
+        row[j] = updated
+        if updated == 0:
+            zeroed.append(j)
+    for j in zeroed:
+        del row[j]
+    return _normalize(row, denominator * p)
+
+
+##########################################
+# Two-Phase Simplex Linear Program Entry #
+##########################################
+
+# Minimizes sum(costs[j] * x[j]) over x >= 0, subject to all the constraints
+# Phase 1 finds a feasible starting point by minimizing the artificial
+# variables, which only the rows that need one get: an AT_MOST row with a
+# nonnegative bound (after flipping signs) starts out with its slack basic
+# Every row starts out with an identity column, its slack or its artificial,
+# and the final reduced cost of that column gives the row's shadow price,
+# so the artificial columns stick around, they just can't come back in
+# Recipe problems are full of degenerate vertices, where the simplex can
+# stall for thousands of pivots that go nowhere, so the AT_MOST bounds get
+# nudged up a tiny bit to break all those ties. Then, once that's optimal,
+# the exact bounds go back in, and the dual simplex cleans up after it,
+# which usually takes just a few pivots.
+# Returns None when the constraints can't all be met, and raises ValueError
+# when the objective can go down forever
+def minimize_linear_program(
+    costs: list[Fraction],
+    constraints: list[LinearConstraint]
+) -> LinearSolution | None:
+    return _minimize_linear_program(costs, constraints, True)
+
+
+def _minimize_linear_program(
+    costs: list[Fraction],
+    constraints: list[LinearConstraint],
+    perturbed: bool
+) -> LinearSolution | None:
+    variable_count = len(costs)
+    slack_start = variable_count
+    artificial_start = slack_start + len(constraints)
+    tableau = _Tableau()
+
+    artificial_count = 0
+    identity_columns: list[int] = []
+    identity_bounds: dict[int, Fraction] = {}
+    flipped: list[bool] = []
+    for i, constraint in enumerate(constraints):
+        if any(not 0 <= j < variable_count for j in constraint.coefficients):
+            raise ValueError("linear constraint has an unknown variable")
+
+        row = dict(constraint.coefficients)
+        rhs = constraint.bound
+        sense = constraint.sense
+        flipped.append(
+            rhs < 0 or (rhs == 0 and sense is ConstraintSense.AT_LEAST)
+        )
+        if flipped[-1]:
+            row = {j: -a for j, a in row.items()}
+            rhs = -rhs
+            if sense is ConstraintSense.AT_LEAST:
+                sense = ConstraintSense.AT_MOST
+            elif sense is ConstraintSense.AT_MOST:
+                sense = ConstraintSense.AT_LEAST
+
+        if sense is ConstraintSense.AT_MOST:
+            row[slack_start + i] = Fraction(1)
+            tableau.add_row(
+                row,
+                rhs + _perturbation(i) if perturbed else rhs,
+                slack_start + i
+            )
+            identity_columns.append(slack_start + i)
+            identity_bounds[slack_start + i] = rhs
+            continue
+
+        if sense is ConstraintSense.AT_LEAST:
+            row[slack_start + i] = Fraction(-1)
+        artificial = artificial_start + artificial_count
+        artificial_count += 1
+        row[artificial] = Fraction(1)
+        tableau.add_row(row, rhs, artificial)
+        identity_columns.append(artificial)
+        identity_bounds[artificial] = rhs
+
+    # Phase 1, get every artificial variable down to zero if possible
+    # The nudged bounds are looser, so if this fails, so would the real ones
+    if artificial_count > 0:
+        tableau.set_objective({
+            artificial_start + k: Fraction(1) for k in range(artificial_count)
+        })
+        tableau.minimize()  # Can't be unbounded, the sum is never negative
+        if tableau.value() > 0:
+            return None
+
+        # Artificials left in the basis are all zero, so pivot them out, and
+        # rows with nothing else left in them were redundant all along
+        for i in reversed(range(len(tableau.rows))):
+            if tableau.basis[i] < artificial_start:
+                continue
+            column = min(
+                (j for j in tableau.rows[i] if 0 <= j < artificial_start),
+                default=None
+            )
+            if column is None:
+                tableau.remove_row(i)
+            else:
+                tableau.pivot(i, column)
+        tableau.column_limit = artificial_start
+
+    # Phase 2, the real objective
+    tableau.set_objective({j: Fraction(c) for j, c in enumerate(costs)})
+    # Looser bounds could make room for an unbounded direction that the real
+    # ones don't, so the exact problem has to settle that one on its own,
+    # unless zero was already a solution to the real ones from the start
+    if not tableau.minimize():
+        if perturbed and artificial_count > 0:
+            return _minimize_linear_program(costs, constraints, False)
+        raise ValueError("linear program objective is unbounded")
+    tableau.set_bounds(identity_bounds)
+    if not tableau.restore_feasibility():
+        return None
+
+    values = [Fraction(0)] * variable_count
+    for i, basic_column in enumerate(tableau.basis):
+        if basic_column < variable_count:
+            values[basic_column] = tableau.rhs(i)
+
+    # The identity columns all cost zero, so their reduced costs are just
+    # the negated shadow prices, and flipped rows flip those back
+    duals = [
+        tableau.reduced_cost(column) * (1 if flip else -1)
+        for column, flip in zip(identity_columns, flipped)
+    ]
+    return LinearSolution(tableau.value(), values, duals)
@@ -18,6 +18,30 @@ def pretty_string(r: Fraction | float | int) -> str:
         return str(round(float(r), ndigits=PRETTY_DIGITS))
 
 
+# Unlike pretty_string(), this never rounds, so it can be read back in exactly
+# Only rationals whose denominators are of the form 2^a * 5^b qualify
+def exact_decimal_string(r: Fraction | int) -> str:
+    r = Fraction(r)
+    denominator = r.denominator
+    twos, fives = 0, 0
+    while denominator % 2 == 0:
+        denominator //= 2
+        twos += 1
+    while denominator % 5 == 0:
+        denominator //= 5
+        fives += 1
+    if denominator != 1:
+        raise ValueError(f"rational {r} has no exact decimal representation")
+
+    digits = max(twos, fives)
+    if digits == 0:
+        return str(r.numerator)
+    scaled = abs(r.numerator * 10 ** digits // r.denominator)
+    whole, fraction = divmod(scaled, 10 ** digits)
+    sign = "-" if r < 0 else ""
+    return f"{sign}{whole}.{fraction:0{digits}d}"
+
+
 ############################
 # Rational Input Utilities #
 ############################
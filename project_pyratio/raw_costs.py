@@ -0,0 +1,227 @@
+# raw_costs.py
+# Tables of what every product costs in raw materials, under fixed recipe picks
+
+from collections.abc import Callable, Collection
+from fractions import Fraction
+
+from products import Product
+from rates import Rate
+from rational_linear_algebra import solve_linear_system
+from recipe_graphs import RecipeGraph
+from recipes import Recipe
+
+
+######################################
+# Recipe Choice Policies for Costing #
+######################################
+
+# A policy picks one recipe to make a product, out of all recipes that have a
+# positive net output of that product (so X-Ray Cracking counts for Hydrogen)
+RecipePolicy = Callable[[Product, Collection[Recipe]], Recipe]
+
+
+# Standard recipes are named after their product, and the alternatives have
+# special names, so prefer the standard one and break other ties by name
+def default_recipe_policy(
+    product: Product,
+    recipes: Collection[Recipe]
+) -> Recipe:
+    for recipe in recipes:
+        if recipe.name == product.name:
+            return recipe
+    return min(recipes, key=lambda r: r.name)
+
+
+def net_output(recipe: Recipe, product: Product) -> int:
+    made = sum(q.quantity for q in recipe.outputs if q.product == product)
+    used = sum(q.quantity for q in recipe.inputs if q.product == product)
+    return made - used
+
+
+###########################################
+# RawCostTable Type and Inner Constructor #
+###########################################
+
+# Raw materials are the products that no recipe makes at all
+# Each product's cost vector says how much of each raw material per second it
+# takes to make the product at 1/s, only counting the recipe inputs
+# Byproducts are not credited back, they're just extra stuff that gets made
+# The vectors are filled in bottom-up over the components of a RecipeGraph,
+# so every input's vector is ready before it's needed. Products in a cyclic
+# component depend on each other, so each such component is solved as one
+# exact linear system instead.
+# A product with no usable recipe, or a loop with no net production, can't be
+# costed, and neither can anything made from it. Those just get their reasons
+# recorded, so the rest of the table still works, and asking for one of their
+# costs is what raises the ValueError.
+# DataBase.raw_cost_table() keeps one in sync with the data.
+class RawCostTable:
+
+    def __init__(
+        self,
+        graph: RecipeGraph,
+        policy: RecipePolicy = default_recipe_policy
+    ) -> None:
+        self.graph = graph
+        self.policy = policy
+
+        self.producers: dict[Product, list[Recipe]] = {}
+        for recipe in graph.compiled.recipes:
+            for quantity in recipe.outputs:
+                if quantity.product not in self.producers:
+                    self.producers[quantity.product] = []
+                if recipe not in self.producers[quantity.product]:
+                    self.producers[quantity.product].append(recipe)
+
+        self.chosen_recipes: dict[Product, Recipe] = {}
+        self.costs: dict[Product, dict[Product, Fraction]] = {}
+        self.uncostable: dict[Product, str] = {}  # Why each one can't be
+        for component_id in range(len(graph.components)):
+            products = graph.component_products(component_id)
+            if len(products) == 0:
+                continue
+            try:
+                if graph.is_cyclic(component_id):
+                    self._cost_cyclic_products(products)
+                else:
+                    self._cost_product(products[0])
+            except ValueError as e:
+                for product in products:
+                    self.chosen_recipes.pop(product, None)
+                    self.uncostable[product] = str(e)
+
+    def _choose_recipe(self, product: Product) -> Recipe:
+        candidates = [
+            r for r in self.producers[product] if net_output(r, product) > 0
+        ]
+        if len(candidates) == 0:
+            raise ValueError(
+                f"no recipe has a positive net output of {product.name!r}"
+            )
+
+        recipe = self.policy(product, candidates)
+        if recipe not in candidates:
+            raise ValueError(
+                f"recipe policy chose unusable recipe {recipe.name!r} "
+                f"for {product.name!r}"
+            )
+        self.chosen_recipes[product] = recipe
+        return recipe
+
+    # Inputs to make one unit of product, not counting the product itself
+    def _unit_inputs(self, product: Product) -> dict[Product, Fraction]:
+        recipe = self._choose_recipe(product)
+        made = net_output(recipe, product)
+
+        unit_inputs: dict[Product, Fraction] = {}
+        for input_ in recipe.inputs:
+            if input_.product != product:
+                unit_inputs[input_.product] = (
+                    unit_inputs.get(input_.product, Fraction(0))
+                    + Fraction(input_.quantity, made)
+                )
+        return unit_inputs
+
+    # Anything made from an uncostable product can't be costed for that reason
+    def _input_cost(self, input_product: Product) -> dict[Product, Fraction]:
+        if input_product in self.uncostable:
+            raise ValueError(self.uncostable[input_product])
+        return self.costs[input_product]
+
+    def _cost_product(self, product: Product) -> None:
+        if product not in self.producers:
+            self.costs[product] = {product: Fraction(1)}
+            return
+
+        cost: dict[Product, Fraction] = {}
+        for input_product, amount in self._unit_inputs(product).items():
+            for raw, raw_amount in self._input_cost(input_product).items():
+                cost[raw] = cost.get(raw, Fraction(0)) + amount * raw_amount
+        self.costs[product] = cost
+
+    # Solves (I - A) C = B, where A holds the unit inputs from inside the
+    # component and B holds the costs of unit inputs from outside of it
+    def _cost_cyclic_products(self, products: tuple[Product, ...]) -> None:
+        position = {product: i for i, product in enumerate(products)}
+        size = len(products)
+        matrix = [
+            [Fraction(int(i == j)) for j in range(size)] for i in range(size)
+        ]
+        outside_costs: list[dict[Product, Fraction]] = []
+
+        for i, product in enumerate(products):
+            outside: dict[Product, Fraction] = {}
+            for input_product, amount in self._unit_inputs(product).items():
+                if input_product in position:
+                    matrix[i][position[input_product]] -= amount
+                    continue
+                for raw, raw_amount in self._input_cost(input_product).items():
+                    outside[raw] = (
+                        outside.get(raw, Fraction(0)) + amount * raw_amount
+                    )
+            outside_costs.append(outside)
+
+        raws = sorted(
+            set(raw for outside in outside_costs for raw in outside),
+            key=lambda p: p.name
+        )
+        right_hand_side = [
+            [outside.get(raw, Fraction(0)) for raw in raws]
+            for outside in outside_costs
+        ]
+
+        try:
+            solution = solve_linear_system(matrix, right_hand_side)
+        except ValueError:
+            names = ", ".join(repr(p.name) for p in products)
+            raise ValueError(
+                f"chosen recipes loop with no raw inputs for: {names}"
+            ) from None
+
+        # Loops that make less than they use have no finite (positive) cost
+        if any(amount < 0 for row in solution for amount in row):
+            names = ", ".join(repr(p.name) for p in products)
+            raise ValueError(
+                f"chosen recipes loop without net production for: {names}"
+            )
+
+        for product, row in zip(products, solution):
+            self.costs[product] = {
+                raw: amount for raw, amount in zip(raws, row) if amount != 0
+            }
+
+    ################################
+    # RawCostTable Query Functions #
+    ################################
+
+    def _cost_vector(self, product: Product | str) -> dict[Product, Fraction]:
+        if not isinstance(product, Product):
+            product = Product(product)
+        if product in self.uncostable:
+            raise ValueError(
+                f"unable to cost {product.name!r}: {self.uncostable[product]}"
+            )
+        if product not in self.costs:
+            raise ValueError(f"unknown product name: {product.name!r}")
+        return self.costs[product]
+
+    def is_raw(self, product: Product | str) -> bool:
+        if not isinstance(product, Product):
+            product = Product(product)
+        return product not in self.producers
+
+    def unit_cost(self, product: Product | str) -> dict[Product, Fraction]:
+        return dict(self._cost_vector(product))
+
+    def raw_materials(self, product: Product | str) -> frozenset[Product]:
+        return frozenset(self._cost_vector(product))
+
+    def raw_cost(
+        self,
+        product: Product | str,
+        rate: Rate
+    ) -> dict[Product, Rate]:
+        return {
+            raw: rate * amount
+            for raw, amount in self._cost_vector(product).items()
+        }
@@ -0,0 +1,172 @@
+# recipe_graphs.py
+# Dependency graph of products and recipes, split into its cyclic components
+
+from array import array
+from collections.abc import Iterator
+
+from compiled_databases import CompiledDataBase
+from products import Product
+from recipes import Recipe
+
+
+##########################################
+# RecipeGraph Type and Inner Constructor #
+##########################################
+
+# The graph is bipartite, and every edge points from a node to something it
+# depends on: each product points to the recipes that make it, and each recipe
+# points to its input products. Products are nodes 0 through P - 1 and recipes
+# are nodes P through P + R - 1, using the IDs from a CompiledDataBase.
+# Cycles like Hydrogen <=> X-Ray Cracking end up in the same strongly connected
+# component (SCC), so the components form a DAG, the condensation of the graph.
+# Components are numbered bottom-up, i.e., every component comes after all of
+# the components that it depends on, so raw materials come first.
+# Use DataBase.recipe_graph() to get one, it keeps this in sync with the data.
+class RecipeGraph:
+
+    def __init__(self, compiled: CompiledDataBase) -> None:
+        self.compiled = compiled
+        self.product_count = len(compiled.products)
+        self.node_count = self.product_count + len(compiled.recipes)
+
+        self.successors: list[list[int]] = [
+            [] for _ in range(self.node_count)
+        ]
+        for recipe_id in range(len(compiled.recipes)):
+            node = self.recipe_node(recipe_id)
+            for product_id, _ in compiled.recipe_outputs(recipe_id):
+                self.successors[product_id].append(node)
+            for product_id, _ in compiled.recipe_inputs(recipe_id):
+                self.successors[node].append(product_id)
+
+        self.component_of = array("q", [-1] * self.node_count)
+        self.components: list[tuple[int, ...]] = []
+        self._find_components()
+
+        # Edges of the condensation DAG, and the length of the longest path
+        # from each component down to a component with no dependencies
+        self.component_successors: list[frozenset[int]] = []
+        self.component_depths = array("q")
+        for component in self.components:
+            successors = frozenset(
+                self.component_of[successor]
+                for node in component
+                for successor in self.successors[node]
+            ) - {self.component_of[component[0]]}
+            self.component_successors.append(successors)
+            self.component_depths.append(1 + max(
+                (self.component_depths[c] for c in successors), default=-1
+            ))
+
+    # Tarjan's algorithm, with an explicit stack so long recipe chains can't
+    # hit the recursion limit, runs in O(nodes + edges)
+    # Tarjan finishes components in exactly the bottom-up order we want
+    def _find_components(self) -> None:
+        index = [-1] * self.node_count
+        low = [0] * self.node_count
+        on_stack = [False] * self.node_count
+        stack: list[int] = []
+        counter = 0
+
+        for root in range(self.node_count):
+            if index[root] >= 0:
+                continue
+
+            index[root] = low[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = True
+            work: list[tuple[int, Iterator[int]]] = [
+                (root, iter(self.successors[root]))
+            ]
+
+            while len(work) > 0:
+                node, children = work[-1]
+                for child in children:
+                    if index[child] < 0:
+                        index[child] = low[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack[child] = True
+                        work.append((child, iter(self.successors[child])))
+                        break
+                    elif on_stack[child]:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if len(work) > 0:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        self._pop_component(stack, on_stack, node)
+
+    def _pop_component(
+        self,
+        stack: list[int],
+        on_stack: list[bool],
+        root: int
+    ) -> None:
+        component_id = len(self.components)
+        members: list[int] = []
+        while True:
+            node = stack.pop()
+            on_stack[node] = False
+            self.component_of[node] = component_id
+            members.append(node)
+            if node == root:
+                break
+        self.components.append(tuple(sorted(members)))
+
+    ##############################
+    # RecipeGraph Node Functions #
+    ##############################
+
+    def product_node(self, product_id: int) -> int:
+        return product_id
+
+    def recipe_node(self, recipe_id: int) -> int:
+        return self.product_count + recipe_id
+
+    def is_product_node(self, node: int) -> bool:
+        return node < self.product_count
+
+    def node_product(self, node: int) -> Product:
+        return self.compiled.products[node]
+
+    def node_recipe(self, node: int) -> Recipe:
+        return self.compiled.recipes[node - self.product_count]
+
+    ###################################
+    # RecipeGraph Component Functions #
+    ###################################
+
+    # Only components with more than one node contain a cycle, since no
+    # product or recipe node can ever point back at itself
+    def is_cyclic(self, component_id: int) -> bool:
+        return len(self.components[component_id]) > 1
+
+    def product_component(self, product: Product | str) -> int:
+        return self.component_of[self.compiled.product_id(product)]
+
+    def recipe_component(self, recipe: Recipe | str) -> int:
+        recipe_node = self.recipe_node(self.compiled.recipe_id(recipe))
+        return self.component_of[recipe_node]
+
+    def component_products(self, component_id: int) -> tuple[Product, ...]:
+        return tuple(
+            self.node_product(node) for node in self.components[component_id]
+            if self.is_product_node(node)
+        )
+
+    def component_recipes(self, component_id: int) -> tuple[Recipe, ...]:
+        return tuple(
+            self.node_recipe(node) for node in self.components[component_id]
+            if not self.is_product_node(node)
+        )
+
+    # Every product, with all of its dependencies listed before it
+    def topological_products(self) -> list[Product]:
+        return [
+            product for component_id in range(len(self.components))
+            for product in self.component_products(component_id)
+        ]
@@ -1,10 +1,17 @@
 # recipe_readers.py
 # Code for parsing recipes from the recipe data file into Python types
 
+from collections.abc import Iterable, Iterator
+import hashlib
 from pathlib import Path
 import re
 
-from abbreviations import AbbreviationResolver
+from abbreviations import (
+    AbbreviationResolver,
+    load_abbreviation_cache,
+    resolution_error,
+    save_abbreviation_cache,
+)
 from databases import DataBase
 from facilities import FacilityCategory
 from products import ProductQuantity
@@ -67,18 +74,75 @@ def _split_on_blank_lines(list_of_lines: list[str]) -> list[list[str]]:
     return list_of_blocks
 
 
-def read_recipe_file(data_file_name: Path, db: DataBase) -> list[list[str]]:
-    with open(data_file_name, "r", encoding="utf-8") as f:
-        file_lines = map(str.strip, f.readlines())
-    file_lines = list(filter(
-        lambda line: re.match(COMMENT_LINE_REGEX, line) is None, file_lines
-    ))
-
+# One resolver for product names and one for facility category names
+# If a cache file is given, previously resolved abbreviations are loaded from
+# it, see _save_resolvers() for writing any newly resolved ones back to it
+def _make_resolvers(
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> tuple[AbbreviationResolver, AbbreviationResolver]:
+    product_resolver = AbbreviationResolver(p.name for p in db.products)
+    category_resolver = AbbreviationResolver(
+        fc.name for fc in db.facility_categories
+    )
+    if abbreviation_cache is not None:
+        load_abbreviation_cache(
+            abbreviation_cache, product_resolver, category_resolver
+        )
+    return product_resolver, category_resolver
+
+
+# The cache file only gets rewritten when something new was resolved
+def _save_resolvers(
+    resolvers: tuple[AbbreviationResolver, AbbreviationResolver],
+    cached_count: int,
+    abbreviation_cache: Path | None = None
+) -> None:
+    resolved_count = sum(len(r.lookup_table) for r in resolvers)
+    if abbreviation_cache is not None and resolved_count > cached_count:
+        save_abbreviation_cache(abbreviation_cache, *resolvers)
+
+
+# Resolve the distinct product and category abbreviations of a recipe file in
+# one batch per resolver, raising one error that reports every failure
+def _resolve_abbreviations(
+    product_abbrevs: Iterable[str],
+    category_abbrevs: Iterable[str],
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> tuple[dict[str, str], dict[str, str]]:
+    resolvers = _make_resolvers(db, abbreviation_cache)
+    product_resolver, category_resolver = resolvers
+    cached_count = sum(len(r.lookup_table) for r in resolvers)
+
+    product_table, product_errors = (
+        product_resolver.try_resolve_all(product_abbrevs)
+    )
+    category_table, category_errors = (
+        category_resolver.try_resolve_all(category_abbrevs)
+    )
+    _save_resolvers(resolvers, cached_count, abbreviation_cache)
+
+    if len(product_errors) + len(category_errors) > 0:
+        raise resolution_error(product_errors + category_errors)
+
+    return product_table, category_table
+
+
+# Expand every abbreviation in a list of stripped, comment-free lines in place
+def _resolve_recipe_lines(
+    file_lines: list[str],
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> list[str]:
     all_products = set(p.name for p in db.products)
-    product_resolver = AbbreviationResolver(all_products)
-
     all_categories = set(fc.name for fc in db.facility_categories)
-    category_resolver = AbbreviationResolver(all_categories)
+
+    # First pass: find the distinct names that still need to be resolved
+    product_lines: list[tuple[int, str, str]] = []
+    category_lines: list[tuple[int, str, str]] = []
+    product_abbrevs: dict[str, None] = {}
+    category_abbrevs: dict[str, None] = {}
 
     for i, line in enumerate(file_lines):
 
@@ -86,20 +150,237 @@ def read_recipe_file(data_file_name: Path, db: DataBase) -> list[list[str]]:
         if m is not None:
             number_string, product_name = m[1], m[2]
             if product_name not in all_products:
-                full_product_name = product_resolver(productname)
-                file_lines[i] = f"{number_string} {full_product_name}"
+                product_lines.append((i, number_string, product_name))
+                product_abbrevs[product_name] = None
             continue
 
         m = re.match(ARROW_LINE_REGEX, line)
         if m is not None:
             seconds_string, category_name = m[1], m[2]
             if category_name not in all_categories:
-                full_category_name = category_resolver(category_name)
-                file_lines[i] = f"^ {seconds_string} s ({full_category_name})"
+                category_lines.append((i, seconds_string, category_name))
+                category_abbrevs[category_name] = None
+
+    product_table, category_table = _resolve_abbreviations(
+        product_abbrevs, category_abbrevs, db, abbreviation_cache
+    )
+
+    # Second pass: rewrite only the lines that actually used abbreviations
+    for i, number_string, product_name in product_lines:
+        full_product_name = product_table[product_name]
+        file_lines[i] = f"{number_string} {full_product_name}"
+
+    for i, seconds_string, category_name in category_lines:
+        full_category_name = category_table[category_name]
+        file_lines[i] = f"^ {seconds_string} s ({full_category_name})"
 
+    return file_lines
+
+
+def read_recipe_file(
+    data_file_name: Path,
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> list[list[str]]:
+    with open(data_file_name, "r", encoding="utf-8") as f:
+        file_lines = map(str.strip, f.readlines())
+    file_lines = list(filter(
+        lambda line: re.match(COMMENT_LINE_REGEX, line) is None, file_lines
+    ))
+
+    _resolve_recipe_lines(file_lines, db, abbreviation_cache)
     return _split_on_blank_lines(file_lines)
 
 
+# Like read_recipe_file(), but for blocks from iter_recipe_blocks() instead
+def resolve_recipe_blocks(
+    recipe_blocks: Iterable[list[str]],
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> list[list[str]]:
+    file_lines: list[str] = []
+    for recipe_block in recipe_blocks:
+        file_lines.extend(recipe_block)
+        file_lines.append("")
+
+    _resolve_recipe_lines(file_lines, db, abbreviation_cache)
+    return _split_on_blank_lines(file_lines)
+
+
+#############################################
+# Recipe Block Hashing for Change Detection #
+#############################################
+
+# Blocks are hashed as written, before abbreviations are expanded, so hashing
+# a file never needs the DataBase. Comment lines don't count towards the hash.
+
+def recipe_block_hash(recipe_block: list[str]) -> str:
+    block_hasher = hashlib.sha256()
+    for line in recipe_block:
+        block_hasher.update(f"{line}\n".encode("utf-8"))
+    return block_hasher.hexdigest()
+
+
+# Yields the unresolved, comment-free lines of each block, one block at a time
+def iter_recipe_blocks(data_file_name: Path) -> Iterator[list[str]]:
+    recipe_block: list[str] = []
+
+    with open(data_file_name, "r", encoding="utf-8") as f:
+        for raw_line in f:
+            line = raw_line.strip()
+            if line.startswith("#"):  # Same test as COMMENT_LINE_REGEX
+                continue
+            if line != "":
+                recipe_block.append(line)
+            elif len(recipe_block) > 0:
+                yield recipe_block
+                recipe_block = []
+
+    if len(recipe_block) > 0:
+        yield recipe_block
+
+
+###############################################
+# Streaming Parser for the Entire Recipe File #
+###############################################
+
+# Everything read_recipe_file() and read_recipe() do, but streamed, in one
+# pass over the file: each line is stripped, matched against the regexes at
+# most once, expanded if it uses an abbreviation, and fed straight into the
+# recipe being built, which is yielded as soon as its block ends, so memory
+# use stays flat. Abbreviations go through memoizing resolvers, so each
+# distinct one only gets looked up the first time it shows up. Bad ones are
+# collected instead of raised, and parsing carries on (without yielding any
+# more recipes) so that one error at the end of the file reports them all.
+# Other errors match the ones read_recipe() gives for the same bad blocks
+
+_EXPECT_OUTPUTS, _EXPECT_INPUTS, _EXPECT_END = range(3)
+
+
+def iter_recipe_file(
+    data_file_name: Path,
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> Iterator[Recipe]:
+    for _, recipe in iter_hashed_recipe_file(
+        data_file_name, db, abbreviation_cache
+    ):
+        yield recipe
+
+
+# Also yields each recipe's recipe_block_hash(), computed along the way
+def iter_hashed_recipe_file(
+    data_file_name: Path,
+    db: DataBase,
+    abbreviation_cache: Path | None = None
+) -> Iterator[tuple[str, Recipe]]:
+    all_products = set(p.name for p in db.products)
+    all_categories = set(fc.name for fc in db.facility_categories)
+
+    resolvers = _make_resolvers(db, abbreviation_cache)
+    product_resolver, category_resolver = resolvers
+    cached_count = sum(len(r.lookup_table) for r in resolvers)
+
+    # Messages for every bad abbreviation so far, as an insertion-ordered set
+    errors: dict[str, None] = {}
+
+    def resolve(resolver: AbbreviationResolver, name: str) -> str | None:
+        try:
+            return resolver(name)
+        except ValueError as e:
+            errors[str(e)] = None
+            return None
+
+    # State of the recipe block currently being read
+    state = _EXPECT_OUTPUTS
+    r_outputs: list[ProductQuantity[int]] = []
+    r_inputs: list[ProductQuantity[int]] = []
+    r_period: Time | None = None
+    r_madein: FacilityCategory | None = None
+    r_name: str | None = None
+    block_hasher = hashlib.sha256()
+
+    # Returns None once there are bad abbreviations, since the recipe might
+    # be missing some of its parts
+    def finish_recipe() -> tuple[str, Recipe] | None:
+        if state == _EXPECT_OUTPUTS:
+            raise ValueError("arrow line index out of bounds")
+        if len(errors) > 0:
+            return None
+        assert r_period is not None and r_madein is not None
+        recipe = Recipe(r_name, r_outputs, r_inputs, r_period, r_madein)
+        return block_hasher.hexdigest(), recipe
+
+    with open(data_file_name, "r", encoding="utf-8") as f:
+        for raw_line in f:
+            line = raw_line.strip()
+
+            if line.startswith("#"):  # Same test as COMMENT_LINE_REGEX
+                continue
+
+            if line == "":
+                if len(r_outputs) > 0 or state != _EXPECT_OUTPUTS:
+                    finished = finish_recipe()
+                    if finished is not None:
+                        yield finished
+                state = _EXPECT_OUTPUTS
+                r_outputs, r_inputs = [], []
+                r_period, r_madein, r_name = None, None, None
+                block_hasher = hashlib.sha256()
+                continue
+
+            block_hasher.update(f"{line}\n".encode("utf-8"))
+
+            if state == _EXPECT_END:
+                raise ValueError(
+                    "started to parse nametag line before end of recipe"
+                )
+
+            m = re.match(INGREDIENT_LINE_REGEX, line)
+            if m is not None:
+                number_string, product_name = m[1], m[2]
+                if product_name not in all_products:
+                    product_name = resolve(product_resolver, product_name)
+                if product_name is None:
+                    continue
+                ingredient = ProductQuantity(
+                    int(number_string), db.intern_product(product_name)
+                )
+                if state == _EXPECT_OUTPUTS:
+                    r_outputs.append(ingredient)
+                else:
+                    r_inputs.append(ingredient)
+                continue
+
+            if state == _EXPECT_OUTPUTS:
+                m = re.match(ARROW_LINE_REGEX, line)
+                if m is None:
+                    raise ValueError(f"unable to parse arrow line: {line!r}")
+                seconds_string, category_name = m[1], m[2]
+                if category_name not in all_categories:
+                    category_name = resolve(category_resolver, category_name)
+                r_period = Time(read_rational(seconds_string))
+                if category_name is not None:
+                    r_madein = db.intern_category(category_name)
+                state = _EXPECT_INPUTS
+                continue
+
+            m = re.match(NAMETAG_LINE_REGEX, line)
+            if m is None:
+                raise ValueError(f"unable to parse nametag line: {line!r}")
+            r_name = str(m[1])
+            state = _EXPECT_END
+
+    if len(r_outputs) > 0 or state != _EXPECT_OUTPUTS:
+        finished = finish_recipe()
+        if finished is not None:
+            yield finished
+
+    _save_resolvers(resolvers, cached_count, abbreviation_cache)
+    if len(errors) > 0:
+        raise resolution_error(list(errors))
+
+
 #########################################
 # Functions for Parsing a Single Recipe #
 #########################################
@@ -137,7 +418,7 @@ def _parse_arrow_line(
 def _parse_nametag_line(recipe_block: list[str], i: int) -> str | None:
     if i < 0 or i >= len(recipe_block):
         return None
-    if i == len(recipe_block) - 1:
+    if i != len(recipe_block) - 1:
         raise ValueError("started to parse nametag line before end of recipe")
 
     m = re.match(NAMETAG_LINE_REGEX, recipe_block[i])
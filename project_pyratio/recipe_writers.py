@@ -0,0 +1,89 @@
+# recipe_writers.py
+# Code for writing Python recipe types back out to a compact recipe data file
+
+from collections.abc import Iterable
+from pathlib import Path
+
+from abbreviations import AbbreviationIndex
+from databases import DataBase
+from products import ProductQuantity
+from rational_utilities import exact_decimal_string
+from recipes import Recipe
+
+
+###################################
+# Abbreviation Tables for Recipes #
+###################################
+
+# See recipe_readers.py for the recipe block grammar that all this must follow
+# Names are only replaced when their shortest unique abbreviation is shorter
+# Every abbreviation is unique across the whole DataBase, so the file stays
+# readable with read_recipe_file() even if more recipes get added to it later
+
+def _make_abbreviation_table(names: Iterable[str]) -> dict[str, str]:
+    abbreviations = AbbreviationIndex(names).generate_abbreviations()
+    return {
+        name: abbrev_str for name, abbrev_str in abbreviations.items()
+        if len(abbrev_str) < len(name)
+    }
+
+
+################################################
+# Functions for Writing Recipes and Data Files #
+################################################
+
+def _write_ingredient_line(
+    ingredient: ProductQuantity[int],
+    product_abbrevs: dict[str, str]
+) -> str:
+    product_name = product_abbrevs.get(ingredient.name, ingredient.name)
+    return f"{ingredient.quantity} {product_name}"
+
+
+def write_recipe(
+    recipe: Recipe,
+    product_abbrevs: dict[str, str] | None = None,
+    category_abbrevs: dict[str, str] | None = None
+) -> list[str]:
+    product_abbrevs = product_abbrevs or {}
+    category_abbrevs = category_abbrevs or {}
+    recipe_block: list[str] = []
+
+    # Tuple order inside a Recipe depends on hash(), so sort for stable files
+    for output in sorted(recipe.outputs, key=lambda q: q.name):
+        recipe_block.append(_write_ingredient_line(output, product_abbrevs))
+
+    seconds_string = exact_decimal_string(recipe.period.seconds)
+    category_name = category_abbrevs.get(
+        recipe.category.name, recipe.category.name
+    )
+    recipe_block.append(f"^ {seconds_string} s ({category_name})")
+
+    for input_ in sorted(recipe.inputs, key=lambda q: q.name):
+        recipe_block.append(_write_ingredient_line(input_, product_abbrevs))
+
+    # Leave the nametag off whenever Recipe would generate the same name
+    if len(recipe.outputs) != 1 or recipe.outputs[0].name != recipe.name:
+        recipe_block.append(f"<> {recipe.name}")
+
+    return recipe_block
+
+
+def write_recipe_file(
+    data_file_name: Path,
+    recipes: Iterable[Recipe],
+    db: DataBase
+) -> None:
+    product_abbrevs = _make_abbreviation_table(p.name for p in db.products)
+    category_abbrevs = _make_abbreviation_table(
+        fc.name for fc in db.facility_categories
+    )
+
+    recipe_blocks = [
+        "\n".join(write_recipe(recipe, product_abbrevs, category_abbrevs))
+        for recipe in recipes
+    ]
+
+    with open(data_file_name, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(recipe_blocks))
+        f.write("\n")
@@ -4,8 +4,8 @@
 from dataclasses import dataclass
 
 from facilities import FacilityCategory
-from products import ProductQuantity
-from rates import Time
+from products import Product, ProductQuantity
+from rates import Rate, Time
 
 
 @dataclass(init=False, frozen=True, slots=True)
@@ -63,6 +63,28 @@ class Recipe:
     def category(self) -> FacilityCategory:
         return self.made_in
 
+    # Net rate of each product in the recipe for one facility at speed 1
+    # Note: this function needs to be careful about not overwriting entries
+    # For example, X-Ray Cracking has Hydrogen inputs *and* outputs
+    def unit_rates(self) -> dict[Product, Rate]:
+        unit_rates: dict[Product, Rate] = {}
+
+        for output in self.outputs:
+            recipe_rate = output.quantity / self.period
+            assert isinstance(recipe_rate, Rate)
+            unit_rates[output.product] = (
+                unit_rates.get(output.product, Rate.zero()) + recipe_rate
+            )
+
+        for input_ in self.inputs:
+            recipe_rate = input_.quantity / self.period
+            assert isinstance(recipe_rate, Rate)
+            unit_rates[input_.product] = (
+                unit_rates.get(input_.product, Rate.zero()) - recipe_rate
+            )
+
+        return unit_rates
+
     # Single line recipe printing
     def __repr__(self) -> str:
         parts: list[str] = []
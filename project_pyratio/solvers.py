@@ -0,0 +1,247 @@
+# solvers.py
+# Automatic factory solving, with no user input, using exact balance equations
+
+from collections.abc import Callable, Collection
+from fractions import Fraction
+
+from databases import DataBase
+from facilities import Facility
+from factories import Factory, RecipeCrafter
+from products import Product, ProductQuantity
+from rate_vectors import NumericMode
+from rates import Rate
+from rational_linear_algebra import solve_linear_system
+from raw_costs import RecipePolicy, default_recipe_policy, net_output
+from recipes import Recipe
+
+
+########################################
+# Facility Choice Policies for Solving #
+########################################
+
+# A policy picks one of the facilities that can craft the given recipe
+FacilityPolicy = Callable[[Recipe, Collection[Facility]], Facility]
+
+
+# The fastest facility needs the fewest buildings, break ties by name
+def default_facility_policy(
+    recipe: Recipe,
+    facilities: Collection[Facility]
+) -> Facility:
+    return min(facilities, key=lambda f: (-f.speed, f.name))
+
+
+#################################
+# Recipe Choices for the Solver #
+#################################
+
+def _choose_recipe(
+    db: DataBase,
+    product: Product,
+    policy: RecipePolicy
+) -> Recipe:
+    candidates = [
+        r for r in db.find_recipes(product) if net_output(r, product) > 0
+    ]
+    if len(candidates) == 0:
+        raise ValueError(
+            f"no recipe has a positive net output of {product.name!r}"
+        )
+
+    recipe = policy(product, candidates)
+    if recipe not in candidates:
+        raise ValueError(
+            f"recipe policy chose unusable recipe {recipe.name!r} "
+            f"for {product.name!r}"
+        )
+    return recipe
+
+
+# Walks down from the goal, choosing one recipe for every craftable product
+# that some chosen recipe has a net input of, so raw materials are left out
+# A recipe can get chosen for more than one product, e.g., when one product
+# is the byproduct of another's recipe, and then only the first product it
+# was chosen for gets to "own" the recipe, in the order they were reached
+def _choose_recipes(
+    db: DataBase,
+    goal: Product,
+    policy: RecipePolicy
+) -> dict[Recipe, Product]:
+    if len(db.find_recipes(goal)) == 0:
+        raise ValueError(f"goal product {goal.name!r} is a raw material")
+
+    owners: dict[Recipe, Product] = {}
+    reached: set[Product] = {goal}
+    queue: list[Product] = [goal]
+
+    for product in queue:  # The queue grows as this loop goes
+        recipe = _choose_recipe(db, product, policy)
+        if recipe in owners:
+            continue
+        owners[recipe] = product
+
+        for input_product, rate in db.unit_rates(recipe).items():
+            if rate >= Rate.zero() or input_product in reached:
+                continue
+            reached.add(input_product)
+            if len(db.find_recipes(input_product)) > 0:
+                queue.append(input_product)
+
+    return owners
+
+
+####################################
+# Product Balance Equation Solving #
+####################################
+
+# There's one unknown per chosen recipe: its multiplier, i.e., how many
+# facilities at speed 1 run it. Each recipe's owner product gets one equation,
+# saying that its net rate over all the chosen recipes must be exactly zero,
+# except for the goal product, which must come out at the goal rate.
+# Loops like Hydrogen <=> X-Ray Cracking are just more equations in the same
+# square system, so the whole thing gets solved in one go by Bareiss.
+def _solve_multipliers(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    owners: dict[Recipe, Product]
+) -> dict[Recipe, Fraction]:
+    recipes = list(owners)
+    products = [owners[recipe] for recipe in recipes]
+    matrix = [
+        [
+            db.unit_rates(recipe).get(product, Rate.zero()).per_second
+            for recipe in recipes
+        ]
+        for product in products
+    ]
+    right_hand_side = [
+        [goal.quantity.per_second if product == goal.product else Fraction(0)]
+        for product in products
+    ]
+
+    try:
+        solution = solve_linear_system(matrix, right_hand_side)
+    except ValueError:
+        names = ", ".join(repr(p.name) for p in products)
+        raise ValueError(
+            f"chosen recipes have no unique balance for: {names}"
+        ) from None
+
+    return {recipe: row[0] for recipe, row in zip(recipes, solution)}
+
+
+# A negative multiplier means byproducts already make more of the recipe's
+# owner than the factory needs, so that recipe gets dropped, its owner is left
+# to run a surplus, and everything else is solved over again. Each round drops
+# a recipe, so this always ends, and the final check in solve_factory() makes
+# sure that no dropped owner ended up short after all.
+def _solve_nonnegative_multipliers(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    owners: dict[Recipe, Product]
+) -> dict[Recipe, Fraction]:
+    owners = dict(owners)
+    while True:
+        multipliers = _solve_multipliers(db, goal, owners)
+        negative = next(
+            (r for r, m in multipliers.items() if m < 0), None
+        )
+        if negative is None:
+            return multipliers
+        if owners[negative] == goal.product:
+            raise ValueError(
+                f"chosen recipes make too much {goal.product.name!r} "
+                f"as a byproduct to meet the goal rate"
+            )
+        del owners[negative]
+
+
+############################
+# Factory Solver Functions #
+############################
+
+# The goal with its product swapped for the DataBase's canonical one
+def intern_goal(
+    db: DataBase,
+    goal: ProductQuantity[Rate]
+) -> ProductQuantity[Rate]:
+    if goal.quantity <= Rate.zero():
+        raise ValueError("factory goal rate must be positive")
+    return ProductQuantity(goal.quantity, db.intern_product(goal.product))
+
+
+def choose_facility(
+    db: DataBase,
+    recipe: Recipe,
+    policy: FacilityPolicy
+) -> Facility:
+    facilities = db.find_facilities(recipe)
+    if len(facilities) == 0:
+        raise ValueError(f"no facility can craft recipe {recipe.name!r}")
+
+    facility = policy(recipe, facilities)
+    if facility not in facilities:
+        raise ValueError(
+            f"facility policy chose unusable facility {facility.name!r} "
+            f"for {recipe.name!r}"
+        )
+    return facility
+
+
+# Sets every raw material the factory is short of as ignored, so nothing is
+# left to expand, after making sure that nothing craftable is short at all
+def ignore_raw_materials(db: DataBase, factory: Factory) -> Factory:
+    shortages = [
+        product for product in factory.negative_rates()
+        if len(db.find_recipes(product)) > 0
+    ]
+    if len(shortages) > 0:
+        names = ", ".join(repr(p.name) for p in shortages)
+        raise ValueError(f"chosen recipes leave shortages of: {names}")
+
+    for product in factory.negative_rates():
+        factory.set_ignored(product)
+    return factory
+
+
+# Turns recipe multipliers (facilities at speed 1) into a finished Factory
+# Crafters are connected in the order of multipliers, skipping zeros, and raw
+# materials are set as ignored, so nothing is left to expand
+def build_factory(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    multipliers: dict[Recipe, Fraction],
+    facility_policy: FacilityPolicy = default_facility_policy,
+    mode: NumericMode = NumericMode.EXACT
+) -> Factory:
+    crafters: list[RecipeCrafter] = []
+    for recipe, multiplier in multipliers.items():
+        if multiplier == 0:
+            continue
+        facility = choose_facility(db, recipe, facility_policy)
+        crafters.append(RecipeCrafter(
+            recipe,
+            facility,
+            multiplier / facility.speed,
+            db.unit_rates(recipe)
+        ))
+    factory = Factory(goal, db, mode).connect_crafters(crafters)
+
+    # Only raw materials should be short now, everything else is balanced
+    return ignore_raw_materials(db, factory)
+
+
+# The non-interactive version of generate_factory() in algorithms.py
+# Crafters are connected in the order their products were reached from the
+# goal, with one recipe per product picked by the recipe policy
+def solve_factory(
+    db: DataBase,
+    goal: ProductQuantity[Rate],
+    recipe_policy: RecipePolicy = default_recipe_policy,
+    facility_policy: FacilityPolicy = default_facility_policy,
+    mode: NumericMode = NumericMode.EXACT
+) -> Factory:
+    goal = intern_goal(db, goal)
+    owners = _choose_recipes(db, goal.product, recipe_policy)
+    multipliers = _solve_nonnegative_multipliers(db, goal, owners)
+    return build_factory(db, goal, multipliers, facility_policy, mode)
@@ -0,0 +1,122 @@
+# test_factories.py
+# Tests for Factory rate sums, run with pytest from this directory
+
+from fractions import Fraction
+
+import pytest
+
+from databases import DataBase
+from facilities import Facility
+from factories import Factory, GapOrder, GapTracker, RecipeCrafter
+from products import ProductQuantity
+from rate_vectors import FLOAT64_INT_LIMIT, NumericMode, np
+from rates import Rate, Time
+from recipes import Recipe
+
+
+# Enough distinct primes that their product is far past what float64 holds
+CHAIN_PRIMES: list[int] = [
+    3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67,
+    71, 73, 79, 83, 89, 97, 101, 103, 107, 109, 113, 127,
+]
+
+
+# Part i turns into part i + 1, so every part only has two crafters on it
+def _make_chain_database() -> DataBase:
+    db = DataBase()
+    category = db.intern_category("Assembler")
+    db.facility_categories.add(category)
+    facility = Facility(category, "", Fraction(3, 4))
+    db.facilities[facility.name] = facility
+
+    parts = [db.intern_product(f"Part {i}") for i in range(31)]
+    db.products.update(parts)
+    for i in range(30):
+        recipe = Recipe(
+            None,
+            [ProductQuantity(i % 3 + 1, parts[i + 1])],
+            [ProductQuantity(i % 4 + 2, parts[i])],
+            Time(Fraction(i % 5 + 1, 2)),
+            category,
+        )
+        db.recipes[recipe.name] = recipe
+    db.make_tables()
+    return db
+
+
+def _make_chain_factory(db: DataBase, mode: NumericMode) -> Factory:
+    goal = ProductQuantity(Rate(Fraction(7, 3)), db.intern_product("Part 30"))
+    facility = db.facilities["Assembler"]
+    crafters = [
+        RecipeCrafter(
+            db.recipes[f"Part {i + 1}"],
+            facility,
+            Fraction(i + 2, CHAIN_PRIMES[i]),
+            db.unit_rates(f"Part {i + 1}"),
+        )
+        for i in range(30)
+    ]
+    return Factory(goal, db, mode).connect_crafters(crafters)
+
+
+# The shared scale of a factory like this is far too fine for float64, but
+# each part's own sum is not, so float mode should never need exact math
+@pytest.mark.skipif(np is None, reason="float mode needs NumPy")
+def test_float_mode_runs_on_many_crafters(monkeypatch) -> None:
+    db = _make_chain_database()
+    exact_factory = _make_chain_factory(db, NumericMode.EXACT)
+    scale = exact_factory.rate_scale()
+    assert scale is not None and scale.denominator >= FLOAT64_INT_LIMIT
+
+    def no_fallback(self: Factory, scale: object) -> None:
+        raise AssertionError("float mode fell back to exact rate sums")
+
+    monkeypatch.setattr(Factory, "_compute_fixed_rates", no_fallback)
+    float_factory = _make_chain_factory(db, NumericMode.FLOAT)
+
+    assert float_factory.rates == exact_factory.rates
+    assert float_factory.rate_scale() == scale
+
+
+# The crafter's cached rates have to follow upgrades to how_many
+def test_crafter_rates_follow_how_many() -> None:
+    db = _make_chain_database()
+    crafter = RecipeCrafter(
+        db.recipes["Part 1"],
+        db.facilities["Assembler"],
+        2,
+        db.unit_rates("Part 1"),
+    )
+    rates = crafter.rates
+    part = db.intern_product("Part 1")
+    before = rates[part]
+
+    crafter.how_many *= Fraction(5, 2)
+    assert rates[part] == before * Fraction(5, 2)
+
+
+# Rates that keep changing leave stale heap entries, which shouldn't pile up
+def test_gap_tracker_drops_stale_entries() -> None:
+    db = _make_chain_database()
+    tracker = GapTracker(db, GapOrder.MAGNITUDE)
+    parts = [db.intern_product(f"Part {i}") for i in range(1, 4)]
+    for step in range(1, 101):
+        for part in parts:
+            tracker.update(part, Rate(-step), False)
+
+    assert len(tracker._heap) <= 2 * len(tracker.gaps)
+    assert tracker.next_gap() == ProductQuantity(Rate(100), parts[0])
+
+
+# Anything assigned to how_many ends up as a positive Fraction
+def test_crafter_how_many_is_checked() -> None:
+    db = _make_chain_database()
+    crafter = RecipeCrafter(
+        db.recipes["Part 1"], db.facilities["Assembler"], 2
+    )
+    crafter.how_many = 0.5
+    assert isinstance(crafter.how_many, Fraction)
+    assert crafter.multiplier == Fraction(3, 8)
+
+    with pytest.raises(ValueError):
+        crafter.how_many = 0
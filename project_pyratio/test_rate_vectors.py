@@ -0,0 +1,24 @@
+# test_rate_vectors.py
+# Tests for RateVector integer math, run with pytest from this directory
+
+import pytest
+
+from rate_vectors import INT64_LIMIT, RateVector, np
+from rates import RateScale
+
+
+# Big units that keep cancelling out should never push the vector off int64
+@pytest.mark.skipif(np is None, reason="int64 vectors need NumPy")
+def test_add_units_stays_int64_when_entries_stay_small() -> None:
+    vector = RateVector.zeros(3, RateScale(1))
+    big = INT64_LIMIT // 4
+    for _ in range(10):
+        vector.add_units([0, 1], [big, -big])
+        vector.add_units([0, 1], [-big, big])
+
+    assert vector.values.dtype == np.int64
+    assert vector.units(0) == 0 and vector.units(1) == 0
+
+    vector.add_units([2], [INT64_LIMIT]).add_units([2], [1])
+    assert vector.values.dtype == object
+    assert vector.units(2) == INT64_LIMIT + 1
@@ -0,0 +1,70 @@
+# test_recipe_readers.py
+# Tests for the recipe file parsers, run with pytest from this directory
+
+from pathlib import Path
+
+import pytest
+
+from databases import DataBase
+from recipe_readers import iter_recipe_file, read_recipe_file
+
+
+def _make_database() -> DataBase:
+    db = DataBase()
+    for name in ["Iron Ore", "Iron Ingot", "Copper Ore", "Copper Ingot"]:
+        db.products.add(db.intern_product(name))
+    db.facility_categories.add(db.intern_category("Smelting Facility"))
+    return db
+
+
+def _write_recipe_file(tmp_path: Path, text: str) -> Path:
+    data_file_name = tmp_path / "recipes.txt"
+    data_file_name.write_text(text, encoding="utf-8")
+    return data_file_name
+
+
+def test_streaming_parser_expands_abbreviations(tmp_path: Path) -> None:
+    data_file_name = _write_recipe_file(
+        tmp_path,
+        "# Smelting\n"
+        "1 IIn\n"
+        "^ 1 s (SF)\n"
+        "1 IO\n"
+        "\n"
+        "1 Copper Ingot\n"
+        "^ 1 s (Smelting Facility)\n"
+        "1 CO\n"
+        "<> Copper Smelting\n",
+    )
+
+    recipes = list(iter_recipe_file(data_file_name, _make_database()))
+
+    assert [r.name for r in recipes] == ["Iron Ingot", "Copper Smelting"]
+    assert recipes[0].inputs[0].product.name == "Iron Ore"
+    assert recipes[1].inputs[0].product.name == "Copper Ore"
+    assert recipes[0].made_in.name == "Smelting Facility"
+
+
+# Every bad abbreviation in the file should show up in the one error, with
+# both parsers, not just the first one that the parser happens to reach
+@pytest.mark.parametrize("parser", [iter_recipe_file, read_recipe_file])
+def test_parsers_report_every_bad_abbreviation(parser, tmp_path: Path) -> None:
+    data_file_name = _write_recipe_file(
+        tmp_path,
+        "1 Iron Ingot\n"
+        "^ 1 s (SF)\n"
+        "1 XO\n"
+        "\n"
+        "1 Copper Ingot\n"
+        "^ 1 s (SF)\n"
+        "1 CO\n"
+        "1 I\n",
+    )
+
+    with pytest.raises(ValueError) as error_info:
+        list(parser(data_file_name, _make_database()))
+
+    message = str(error_info.value)
+    assert "unable to resolve 2 abbreviation(s)" in message
+    assert "'XO'" in message
+    assert "'I'" in message